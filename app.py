@@ -9,57 +9,43 @@ Streamlit App — Light Theme Refresh (UI Polished, English UI)
 import streamlit as st
 import pandas as pd
 from io import BytesIO
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
 import re
 import os
 import base64
+import hashlib
+import json
 import requests
-from datetime import datetime
-
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl import load_workbook, Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import NamedStyle
-from PIL import Image
-
-# Google Sheet ID loader added automatically
-def load_online_doctor_ids():
-    import requests
-    from openpyxl import load_workbook
-    from io import BytesIO
-    GDRIVE_SHEET_URL = ("https://docs.google.com/spreadsheets/d/1-u3cegWgrsoXvJYWVwQQRJbyYbdYtjIMDIifnalwHqo/export?format=xlsx")
-    try:
-        r = requests.get(GDRIVE_SHEET_URL)
-        if r.status_code != 200:
-            return {}, "⚠️ Cannot access Google Sheet."
-        wb = load_workbook(BytesIO(r.content))
-        ws = wb.active
-        headers=[str(ws.cell(1,c).value).strip().lower() if ws.cell(1,c).value else '' for c in range(1,ws.max_column+1)]
-        dcol=icol=None
-        for i,h in enumerate(headers):
-            if any(x in h for x in ['doctor','اسم','name','دكتور']): dcol=i+1
-            if any(x in h for x in ['id','رقم','بطاقة','national','identity']): icol=i+1
-        if not dcol or not icol: return {}, f"⚠️ Missing columns: {headers}"
-        idd={}
-        for r in range(2,ws.max_row+1):
-            n=ws.cell(r,dcol).value; v=ws.cell(r,icol).value
-            if n and v:
-                c=str(n).strip(); s=str(v).strip()
-                idd[c]=s; idd[c.lower()]=s; idd[c.replace(' ','')]=s
-        return idd, f"✅ Loaded {len(idd)//3} doctor IDs"
-    except Exception as e:
-        return {}, f"❌ Error: {e}"
-
-# Optional animations
-try:
-    from streamlit_lottie import st_lottie  # type: ignore
-except Exception:
-    st_lottie = None
+from streamlit.runtime.media_file_manager import MediaFileManager
+
+from excel_engine import (
+    new_output_workbook, default_workers,
+    split_csv_stream, CSV_CHUNK_ROWS, split_sheet_by_column,
+    temp_output, finish_temp_output, save_workbook_to_temp, CSV_ZIP_LEVEL,
+    run_parallel, merge_workbooks, sheet_header, header_keys,
+    merge_frames, iter_sheet_chunks, sheet_columns,
+)
+from csv_ingest import read_csv_frame, iter_csv_chunks, csv_columns
+from xlsx_package import workbook_sheets, sheet_preview, split_sheet_packages, PREVIEW_ROWS
+from processor import process_workbook, process_batch_file, batch_inputs
+from mappings import DOCTOR_IDS, BUM_MAPPING, STORE
+from mapping_store import RowManifest
+from name_match import FUZZY_THRESHOLD
+
+# Offline / air-gapped servers: skip every optional network fetch at startup
+OFFLINE = os.environ.get("TFE_OFFLINE", "") == "1"
+
+# Optional animations (loaded on first use, never at startup)
+LOTTIE_URLS = {
+    "split": "https://assets9.lottiefiles.com/packages/lf20_wx9z5gxb.json",
+    "merge": "https://assets10.lottiefiles.com/packages/lf20_cg3rwjul.json",
+}
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
 
 
 def load_lottie_url(url: str):
     try:
-        r = requests.get(url, timeout=8)
+        r = requests.get(url, timeout=3)
         if r.status_code == 200:
             return r.json()
     except Exception:
@@ -75,8 +61,27 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-LOTTIE_SPLIT = load_lottie_url("https://assets9.lottiefiles.com/packages/lf20_wx9z5gxb.json")
-LOTTIE_MERGE = load_lottie_url("https://assets10.lottiefiles.com/packages/lf20_cg3rwjul.json")
+
+@st.cache_resource(show_spinner=False)
+def load_lottie(name: str):
+    """Bundled assets/lottie_<name>.json if present, else the CDN (once per server, skipped offline)."""
+    path = os.path.join(ASSETS_DIR, f"lottie_{name}.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    if OFFLINE:
+        return None
+    return load_lottie_url(LOTTIE_URLS[name])
+
+
+def show_lottie(name: str, height: int):
+    try:
+        from streamlit_lottie import st_lottie  # type: ignore
+    except Exception:
+        return
+    data = load_lottie(name)
+    if data:
+        st_lottie(data, height=height, key=f"lottie_{name}")
 
 
 # =================== THEME TOGGLE (optional) ===================
@@ -201,12 +206,32 @@ st.markdown(custom_css, unsafe_allow_html=True)
 
 
 # ------------------ Helpers ------------------
+# A callable as download_button `data` is run on click (newer Streamlit versions)
+DEFERRED_DOWNLOADS = hasattr(MediaFileManager, "add_deferred")
+
 def display_uploaded_files(file_list, file_type="Files"):
     if file_list:
         st.markdown("**Uploaded files:**")
         for i, f in enumerate(file_list):
             st.caption(f"{i+1}. {f.name} — {f.size//1024} KB")
 
+def show_csv_stats(stats_list):
+    """One caption for the CSV reads of an action: rows/s, parser, encoding and delimiter."""
+    stats_list = [s for s in stats_list if s]
+    if not stats_list:
+        return
+    rows = sum(s['rows'] for s in stats_list)
+    seconds = sum(s['seconds'] for s in stats_list)
+    formats = sorted({f"{s['encoding']}, delimiter {s['delimiter']!r}, {s['engine']} parser" for s in stats_list})
+    st.caption(f"CSV read: {rows:,} rows in {seconds:.2f} s ({rows / max(seconds, 1e-9):,.0f} rows/s) — {'; '.join(formats)}")
+
+def download_data(read_output):
+    """
+    `data` for st.download_button from a `finish_temp_output` reader: deferred,
+    so the file is read only when the user clicks, where Streamlit supports it.
+    """
+    return read_output if DEFERRED_DOWNLOADS else read_output()
+
 def _safe_name(s):
     return re.sub(r"[^A-Za-z0-9_-]+", "_", str(s))
 
@@ -217,131 +242,32 @@ def get_image_as_base64(image_path):
     except Exception:
         return None
 
-def copy_cell_style(src_cell, dst_cell):
-    """نسخ كل التنسيقات من خلية لأخرى"""
-    if src_cell.has_style:
-        try:
-            if src_cell.font:
-                dst_cell.font = Font(
-                    name=src_cell.font.name,
-                    size=src_cell.font.size,
-                    bold=src_cell.font.bold,
-                    italic=src_cell.font.italic,
-                    vertAlign=src_cell.font.vertAlign,
-                    underline=src_cell.font.underline,
-                    strike=src_cell.font.strike,
-                    color=src_cell.font.color
-                )
-            if src_cell.fill and src_cell.fill.fill_type:
-                dst_cell.fill = PatternFill(
-                    fill_type=src_cell.fill.fill_type,
-                    start_color=src_cell.fill.start_color,
-                    end_color=src_cell.fill.end_color
-                )
-            if src_cell.alignment:
-                dst_cell.alignment = Alignment(
-                    horizontal=src_cell.alignment.horizontal,
-                    vertical=src_cell.alignment.vertical,
-                    text_rotation=src_cell.alignment.text_rotation,
-                    wrap_text=src_cell.alignment.wrap_text,
-                    shrink_to_fit=src_cell.alignment.shrink_to_fit,
-                    indent=src_cell.alignment.indent
-                )
-            if src_cell.border:
-                dst_cell.border = Border(
-                    left=src_cell.border.left,
-                    right=src_cell.border.right,
-                    top=src_cell.border.top,
-                    bottom=src_cell.border.bottom,
-                    diagonal=src_cell.border.diagonal,
-                    diagonal_direction=src_cell.border.diagonal_direction,
-                    outline=src_cell.border.outline,
-                    vertical=src_cell.border.vertical,
-                    horizontal=src_cell.border.horizontal
-                )
-            dst_cell.number_format = src_cell.number_format
-        except Exception:
-            pass
-
-def copy_column_widths(src_ws, dst_ws):
-    """نسخ عرض الأعمدة"""
-    try:
-        for col_letter in src_ws.column_dimensions:
-            col_width = src_ws.column_dimensions[col_letter].width
-            if col_width:
-                dst_ws.column_dimensions[col_letter].width = col_width
-    except Exception:
-        pass
-
-def load_bum_mapping():
-    """تحميل ملف BUM من Google Sheets"""
-    try:
-        url = "https://docs.google.com/spreadsheets/d/1XQnQNDFHDKrWYn23ROAeFS2cELNbKurC/export?format=xlsx"
-        response = requests.get(url)
-        if response.status_code == 200:
-            wb = load_workbook(filename=BytesIO(response.content))
-            ws = wb.active
-            
-            data = []
-            headers = [cell.value for cell in ws[1]]
-            mr_idx = None
-            bum_idx = None
-            
-            for i, header in enumerate(headers):
-                if header and "MR" in str(header):
-                    mr_idx = i + 1
-                elif header and "BUM" in str(header):
-                    bum_idx = i + 1
-            
-            if mr_idx and bum_idx:
-                for row in range(2, ws.max_row + 1):
-                    mr_value = ws.cell(row, mr_idx).value
-                    bum_value = ws.cell(row, bum_idx).value
-                    if mr_value and bum_value:
-                        data.append({
-                            'MR': str(mr_value).strip(),
-                            'BUM': str(bum_value).strip()
-                        })
-            
-            return pd.DataFrame(data)
-    except Exception as e:
-        st.warning(f"⚠️ Could not load BUM mapping: {e}")
-        return pd.DataFrame()
-
-# ===================== NEW HELPER: Robust Value Comparison =====================
-def _is_match(cell_value, target_value):
-    """
-    مقارنة ذكية بين قيمة الخلية وقيمة الهدف
-    تتعامل مع الأرقام، النصوص، والمسافات بدقة
-    """
-    # Handle None/Empty cases
-    if cell_value is None and target_value is None:
-        return True
-    if cell_value is None or target_value is None:
-        return False
-    
-    # Convert both to string for text comparison (strip whitespace)
-    str_cell = str(cell_value).strip()
-    str_target = str(target_value).strip()
-    
-    # Direct string match
-    if str_cell == str_target:
-        return True
-    
-    # Handle numeric comparison (int vs float)
-    try:
-        if float(cell_value) == float(target_value):
-            return True
-    except (ValueError, TypeError):
-        pass
-    
-    # Case-insensitive match for strings
-    if str_cell.lower() == str_target.lower():
-        return True
-        
-    return False
-# =============================================================================
-
+# ------------------ Upload parse cache ------------------
+# Streamlit reruns the whole script on every click; parse each upload once.
+# Keys are a hash of the uploaded bytes (+ sheet), so re-uploads of the same
+# file hit the cache too. Args starting with "_" are not hashed by Streamlit.
+def upload_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def cached_sheet_list(digest, _data):
+    """(name, part, dimension) per sheet, from workbook.xml: no workbook load."""
+    return workbook_sheets(_data)
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def cached_sheet_preview(digest, sheet_name, _data, nrows=PREVIEW_ROWS):
+    """First rows of a sheet for the preview and column list; the split reads the whole sheet."""
+    return sheet_preview(_data, sheet_name, nrows)
+
+@st.cache_data(max_entries=8, ttl=3600, show_spinner=False)
+def cached_csv_head(digest, _data, nrows=200):
+    """First rows of a CSV for the preview and column list; the split itself streams the file."""
+    return read_csv_frame(_data, nrows=nrows)
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def cached_sheet_header(digest, _data):
+    """Header row values of the active sheet."""
+    return list(sheet_header(_data)[1][0])
 
 # ------------------ Header ------------------
 logo_b64 = get_image_as_base64("logo.png")
@@ -356,602 +282,651 @@ header_html = f"""
 """
 st.markdown(header_html, unsafe_allow_html=True)
 
-if 'clear_counter' not in st.session_state:
-    st.session_state.clear_counter = 0
+# Each card is a st.fragment: interacting with one card re-runs only that
+# card, not the parsing / mapping work of the others.
+if 'clear_counters' not in st.session_state:
+    st.session_state.clear_counters = {}
+
+def card_counter(card):
+    return st.session_state.clear_counters.get(card, 0)
+
+def clear_card(card):
+    """Reset one card's uploader; only that card re-runs."""
+    st.session_state.clear_counters[card] = card_counter(card) + 1
+    st.rerun(scope="fragment")
 
 
 # ===================== Split Card =====================
-with st.container():
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.markdown("### ✂️ Split Excel/CSV File")
-    st.markdown('<span class="hint">Upload an Excel or CSV file, then select the column to split by. A ZIP will be generated with one file per value.</span>', unsafe_allow_html=True)
-
-    uploaded_file = st.file_uploader(
-        "📂 Upload Excel or CSV",
-        type=["xlsx", "csv"],
-        accept_multiple_files=False,
-        key=f"split_uploader_{st.session_state.clear_counter}",
-    )
-
-    if uploaded_file:
-        display_uploaded_files([uploaded_file])
-        c1, c2 = st.columns([1,1])
-        with c1:
-            if st.button("🧹 Clear file", key="clear_split"):
-                st.session_state.clear_counter += 1
-                st.rerun()
-
-        try:
-            file_ext = uploaded_file.name.split(".")[-1].lower()
-            if file_ext == "csv":
-                df = pd.read_csv(uploaded_file)
-                selected_sheet = "Sheet1"
-                st.success("✅ CSV file uploaded successfully")
-            else:
-                input_bytes = uploaded_file.getvalue()
-                original_wb = load_workbook(filename=BytesIO(input_bytes), data_only=False)
-                sheet_names = original_wb.sheetnames
-                selected_sheet = st.selectbox("Select sheet to split", sheet_names)
-                df = pd.read_excel(BytesIO(input_bytes), sheet_name=selected_sheet)
+@st.fragment
+def split_card():
+    with st.container():
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("### ✂️ Split Excel/CSV File")
+        st.markdown('<span class="hint">Upload an Excel or CSV file, then select the column to split by. A ZIP will be generated with one file per value.</span>', unsafe_allow_html=True)
+
+        uploaded_file = st.file_uploader(
+            "📂 Upload Excel or CSV",
+            type=["xlsx", "csv"],
+            accept_multiple_files=False,
+            key=f"split_uploader_{card_counter('split')}",
+        )
+
+        if uploaded_file:
+            display_uploaded_files([uploaded_file])
+            c1, c2 = st.columns([1,1])
+            with c1:
+                if st.button("🧹 Clear file", key="clear_split"):
+                    clear_card("split")
 
-            st.dataframe(df.head(200), use_container_width=True)
+            try:
+                file_ext = uploaded_file.name.split(".")[-1].lower()
+                input_bytes = uploaded_file.getvalue()
+                input_digest = upload_digest(input_bytes)
+                if file_ext == "csv":
+                    df = cached_csv_head(input_digest, input_bytes)
+                    selected_sheet = "Sheet1"
+                    st.success("✅ CSV file uploaded successfully")
+                else:
+                    sheet_dims = {name: dim for name, _part, dim in cached_sheet_list(input_digest, input_bytes)}
+                    sheet_names = list(sheet_dims)
+                    selected_sheet = st.selectbox("Select sheet to split", sheet_names)
+                    if sheet_dims[selected_sheet]:
+                        st.caption(f"Used range: {sheet_dims[selected_sheet]}")
+                    df = cached_sheet_preview(input_digest, selected_sheet, input_bytes)
+
+                st.dataframe(df.head(PREVIEW_ROWS), use_container_width=True)
             
-            # Ensure column names are strings for selection
-            df.columns = df.columns.astype(str)
-            col_to_split = st.selectbox("Select column to split by", df.columns)
+                # Ensure column names are strings for selection
+                df.columns = df.columns.astype(str)
+                col_to_split = st.selectbox("Select column to split by", df.columns)
             
-            split_option = st.radio(
-                "Split method:",
-                ["Split by Column Values", "Split Each Sheet into Separate File"],
-                horizontal=True,
-            )
-
-            if st.button("🚀 Start"):
-                with st.spinner("Processing..."):
-                    if st_lottie and LOTTIE_SPLIT:
-                        st_lottie(LOTTIE_SPLIT, height=110, key="lottie_split")
-
-                    def clean_name(name: str) -> str:
-                        name = str(name).strip()
-                        invalid_chars = r'[\\/*?:\[\]\n<>:"\']'
-                        cleaned = re.sub(invalid_chars, "_", name)
-                        return cleaned[:30] if cleaned else "Sheet"
-
-                    if file_ext == "csv":
-                        unique_values = df[col_to_split].dropna().unique()
-                        zip_buffer = BytesIO()
-                        with ZipFile(zip_buffer, "w") as zip_file:
-                            for value in unique_values:
-                                filtered_df = df[df[col_to_split] == value]
-                                csv_buffer = BytesIO()
-                                filtered_df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-                                csv_buffer.seek(0)
-                                zip_file.writestr(f"{clean_name(value)}.csv", csv_buffer.read())
-                        zip_buffer.seek(0)
-                        st.success("🎉 Split completed! ZIP is ready.")
-                        st.download_button(
-                            "⬇️ Download (ZIP)",
-                            zip_buffer.getvalue(),
-                            file_name=f"Split_{_safe_name(uploaded_file.name.rsplit('.',1)[0])}.zip",
-                            mime="application/zip"
-                        )
-                    else:
-                        ws = original_wb[selected_sheet]
-                        if split_option == "Split by Column Values":
-                            col_idx = df.columns.get_loc(col_to_split) + 1
-                            unique_values = df[col_to_split].dropna().unique()
-                            
-                            progress_bar = st.progress(0)
+                split_option = st.radio(
+                    "Split method:",
+                    ["Split by Column Values", "Split Each Sheet into Separate File"],
+                    horizontal=True,
+                )
+                split_workers = default_workers()
+                if file_ext != "csv" and split_option == "Split by Column Values":
+                    split_workers = st.number_input(
+                        "Parallel workers (1 = serial)",
+                        min_value=1,
+                        max_value=default_workers(),
+                        value=default_workers(),
+                        key="split_workers",
+                    )
+                csv_zip_level = CSV_ZIP_LEVEL
+                if file_ext == "csv":
+                    csv_zip_level = st.slider(
+                        "ZIP compression level for CSV files (0 = none, 9 = smallest)",
+                        min_value=0,
+                        max_value=9,
+                        value=CSV_ZIP_LEVEL,
+                        key="split_csv_level",
+                    )
+
+                if st.button("🚀 Start"):
+                    with st.spinner("Processing..."):
+                        show_lottie("split", height=110)
+
+                        def clean_name(name: str) -> str:
+                            name = str(name).strip()
+                            invalid_chars = r'[\\/*?:\[\]\n<>:"\']'
+                            cleaned = re.sub(invalid_chars, "_", name)
+                            return cleaned[:30] if cleaned else "Sheet"
+
+                        if file_ext == "csv":
                             status_text = st.empty()
-                            
-                            zip_buffer = BytesIO()
-                            with ZipFile(zip_buffer, "w") as zip_file:
-                                for i, value in enumerate(unique_values):
-                                    status_text.text(f"Processing: {clean_name(value)}")
-                                    progress_bar.progress((i + 1) / len(unique_values))
-                                    
-                                    new_wb = Workbook()
-                                    default_ws = new_wb.active
-                                    new_wb.remove(default_ws)
-                                    new_ws = new_wb.create_sheet(title=clean_name(value))
-                                    
-                                    # Copy Header
-                                    for cell in ws[1]:
-                                        dst = new_ws.cell(1, cell.column, cell.value)
-                                        copy_cell_style(cell, dst)
-                                    
-                                    # Copy Data Rows with Robust Matching
-                                    row_out = 2
-                                    for row in ws.iter_rows(min_row=2):
-                                        cell_value = row[col_idx - 1].value
-                                        # Use the new robust comparison function
-                                        if _is_match(cell_value, value):
-                                            for src in row:
-                                                dst = new_ws.cell(row_out, src.column, src.value)
-                                                copy_cell_style(src, dst)
-                                            row_out += 1
-                                    
-                                    copy_column_widths(ws, new_ws)
-                                    
-                                    fb = BytesIO()
-                                    new_wb.save(fb)
-                                    fb.seek(0)
-                                    zip_file.writestr(f"{clean_name(value)}.xlsx", fb.read())
-                            
+
+                            def _on_rows(rows_read):
+                                status_text.text(f"Rows split: {rows_read:,}")
+
+                            # Chunked single pass: the whole CSV is never loaded as a DataFrame
+                            read_stats = {}
+                            with temp_output(".zip") as zip_out, ZipFile(zip_out, "w") as zip_file:
+                                split_csv_stream(
+                                    zip_file,
+                                    iter_csv_chunks(input_bytes, CSV_CHUNK_ROWS, read_stats, dtype=str),
+                                    col_to_split, clean_name,
+                                    level=csv_zip_level, on_progress=_on_rows,
+                                )
+                            zip_reader = finish_temp_output(zip_out)
                             status_text.empty()
-                            progress_bar.empty()
-                            zip_buffer.seek(0)
+                            show_csv_stats([read_stats])
                             st.success("🎉 Split completed! ZIP is ready.")
                             st.download_button(
                                 "⬇️ Download (ZIP)",
-                                zip_buffer.getvalue(),
+                                download_data(zip_reader),
                                 file_name=f"Split_{_safe_name(uploaded_file.name.rsplit('.',1)[0])}.zip",
                                 mime="application/zip"
                             )
                         else:
-                            zip_buffer = BytesIO()
-                            with ZipFile(zip_buffer, "w") as zip_file:
-                                for sheet_name in original_wb.sheetnames:
-                                    new_wb = Workbook()
-                                    default_ws = new_wb.active
-                                    new_wb.remove(default_ws)
-                                    new_ws = new_wb.create_sheet(title=sheet_name)
-                                    src_ws = original_wb[sheet_name]
-                                    
-                                    for row in src_ws.iter_rows():
-                                        for src_cell in row:
-                                            dst = new_ws.cell(src_cell.row, src_cell.column, src_cell.value)
-                                            copy_cell_style(src_cell, dst)
-                                    
-                                    for merged_range in src_ws.merged_cells.ranges:
-                                        new_ws.merge_cells(str(merged_range))
-                                    copy_column_widths(src_ws, new_ws)
-                                    fb = BytesIO()
-                                    new_wb.save(fb)
-                                    fb.seek(0)
-                                    zip_file.writestr(f"{_safe_name(sheet_name)}.xlsx", fb.read())
-                            zip_buffer.seek(0)
-                            st.success("🎉 Split by sheets completed! ZIP is ready.")
-                            st.download_button(
-                                "⬇️ Download (ZIP)",
-                                zip_buffer.getvalue(),
-                                file_name=f"SplitBySheets_{_safe_name(uploaded_file.name.rsplit('.',1)[0])}.zip",
-                                mime="application/zip"
-                            )
-        except Exception as e:
-            st.error(f"❌ Error while splitting: {e}")
-    st.markdown('</div>', unsafe_allow_html=True)
+                            if split_option == "Split by Column Values":
+                                progress_bar = st.progress(0)
+                                status_text = st.empty()
+                            
+                                def _on_progress(done, total, name):
+                                    status_text.text(f"Processing: {name}")
+                                    progress_bar.progress(done / total)
+                            
+                                # xlsx files are already deflated: store them as-is
+                                with temp_output(".zip") as zip_out, ZipFile(zip_out, "w", ZIP_STORED) as zip_file:
+                                    # One read-only pass over the sheet; rows grouped by normalized
+                                    # key (numbers, spaces, case), as in the CSV split
+                                    for name, data in split_sheet_by_column(
+                                        input_bytes, selected_sheet, list(df.columns).index(col_to_split),
+                                        clean_name, _on_progress, workers=int(split_workers)
+                                    ):
+                                        zip_file.writestr(f"{name}.xlsx", data)
+                            
+                                zip_reader = finish_temp_output(zip_out)
+                                status_text.empty()
+                                progress_bar.empty()
+                                st.success("🎉 Split completed! ZIP is ready.")
+                                st.download_button(
+                                    "⬇️ Download (ZIP)",
+                                    download_data(zip_reader),
+                                    file_name=f"Split_{_safe_name(uploaded_file.name.rsplit('.',1)[0])}.zip",
+                                    mime="application/zip"
+                                )
+                            else:
+                                with temp_output(".zip") as zip_out, ZipFile(zip_out, "w", ZIP_STORED) as zip_file:
+                                    # Each output is the original package cut down to one sheet:
+                                    # no cells are parsed, and everything in the sheet XML is kept
+                                    for sheet_name, data in split_sheet_packages(input_bytes):
+                                        zip_file.writestr(f"{_safe_name(sheet_name)}.xlsx", data)
+                                zip_reader = finish_temp_output(zip_out)
+                                st.success("🎉 Split by sheets completed! ZIP is ready.")
+                                st.download_button(
+                                    "⬇️ Download (ZIP)",
+                                    download_data(zip_reader),
+                                    file_name=f"SplitBySheets_{_safe_name(uploaded_file.name.rsplit('.',1)[0])}.zip",
+                                    mime="application/zip"
+                                )
+            except Exception as e:
+                st.error(f"❌ Error while splitting: {e}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+split_card()
 
 
 # ===================== Merge Card =====================
-with st.container():
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.markdown("### 🔁 Merge Excel/CSV Files")
-    st.markdown('<span class="hint">Upload multiple files and they will be merged into one file with preserved formatting.</span>', unsafe_allow_html=True)
-
-    merge_files = st.file_uploader(
-        "📂 Upload Excel/CSV files to merge",
-        type=["xlsx", "csv"],
-        accept_multiple_files=True,
-        key=f"merge_uploader_{st.session_state.clear_counter}",
-    )
-
-    if merge_files:
-        display_uploaded_files(merge_files)
-        c1, c2 = st.columns([1,1])
-        with c1:
-            if st.button("🧹 Clear files", key="clear_merge"):
-                st.session_state.clear_counter += 1
-                st.rerun()
-        with c2:
-            if st.button("✨ Merge files"):
-                with st.spinner("Merging..."):
-                    if st_lottie and LOTTIE_MERGE:
-                        st_lottie(LOTTIE_MERGE, height=100, key="lottie_merge")
-                    try:
-                        all_excel = all(f.name.lower().endswith('.xlsx') for f in merge_files)
+@st.fragment
+def merge_card():
+    with st.container():
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("### 🔁 Merge Excel/CSV Files")
+        st.markdown('<span class="hint">Upload multiple files and they will be merged into one file with preserved formatting.</span>', unsafe_allow_html=True)
+
+        merge_files = st.file_uploader(
+            "📂 Upload Excel/CSV files to merge",
+            type=["xlsx", "csv"],
+            accept_multiple_files=True,
+            key=f"merge_uploader_{card_counter('merge')}",
+        )
+
+        if merge_files:
+            display_uploaded_files(merge_files)
+            merge_workers = default_workers()
+            merge_align = "By position"
+            merge_dedupe = False
+            dedupe_key = "Entire row"
+            merge_sort = "Upload order (no sorting)"
+            merge_format = "Excel (.xlsx)"
+            if all(f.name.lower().endswith('.xlsx') for f in merge_files):
+                if len(merge_files) > 1:
+                    merge_workers = st.number_input(
+                        "Parallel workers (1 = serial)",
+                        min_value=1,
+                        max_value=default_workers(),
+                        value=default_workers(),
+                        key="merge_workers",
+                    )
+                merge_align = st.radio(
+                    "Match columns",
+                    ["By position", "By header name"],
+                    horizontal=True,
+                    key="merge_align",
+                    help="By header name lines up columns that are in a different order in each file; the output has every column found in any file.",
+                )
+                header_names = []
+                seen_keys = set()
+                header_files = merge_files if merge_align == "By header name" else merge_files[:1]
+                for file in header_files:
+                    data = file.getvalue()
+                    headers = cached_sheet_header(upload_digest(data), data)
+                    for header, key in zip(headers, header_keys(headers)):
+                        if header is not None and key[1] == 1 and key not in seen_keys:
+                            seen_keys.add(key)
+                            header_names.append(str(header).strip())
+                merge_sort = st.selectbox(
+                    "Sort merged rows by",
+                    ["Upload order (no sorting)"] + header_names,
+                    key="merge_sort",
+                    help="Ascending: numbers, then dates, then text; empty cells last. Rows with equal values keep their upload order.",
+                )
+                merge_dedupe = st.checkbox("🧹 Remove duplicate rows", key="merge_dedupe")
+                if merge_dedupe:
+                    dedupe_key = st.selectbox(
+                        "Rows are duplicates when they have the same",
+                        ["Entire row"] + header_names,
+                        key="merge_dedupe_key",
+                        help="The first row with each value is kept. Rows with an empty key are never removed.",
+                    )
+            else:
+                merge_format = st.radio(
+                    "Output format",
+                    ["Excel (.xlsx)", "CSV (.csv)"],
+                    horizontal=True,
+                    key="merge_format",
+                    help="CSV keeps every value as text and is much faster to write for large exports.",
+                )
+            c1, c2 = st.columns([1,1])
+            with c1:
+                if st.button("🧹 Clear files", key="clear_merge"):
+                    clear_card("merge")
+            with c2:
+                if st.button("✨ Merge files"):
+                    with st.spinner("Merging..."):
+                        show_lottie("merge", height=100)
+                        try:
+                            all_excel = all(f.name.lower().endswith('.xlsx') for f in merge_files)
                         
-                        if all_excel:
-                            merged_wb = Workbook()
-                            merged_ws = merged_wb.active
-                            merged_ws.title = "Merged_Data"
+                            if all_excel:
+                                # Write-only output: rows stream to disk instead of piling up as Cell objects
+                                merged_wb, merged_ws = new_output_workbook("Merged_Data")
                             
-                            current_row = 1
-                            headers_copied = False
+                                progress_bar = st.progress(0)
+                                status_text = st.empty()
+
+                                def _on_progress(done, total, name):
+                                    status_text.text(f"Merged {done}/{total}: {name}")
+                                    progress_bar.progress(done / total)
+
+                                # Files are parsed in parallel and appended in upload order
+                                # (or k-way merged from sorted runs on disk)
+                                merged_rows, dropped = merge_workbooks(
+                                    merged_ws,
+                                    ((file.name, file.getvalue()) for file in merge_files),
+                                    _on_progress,
+                                    workers=int(merge_workers),
+                                    align_headers=merge_align == "By header name",
+                                    dedupe=merge_dedupe,
+                                    key_column=None if dedupe_key == "Entire row" else dedupe_key,
+                                    sort_column=None if merge_sort == "Upload order (no sorting)" else merge_sort,
+                                )
                             
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
+                                status_text.empty()
+                                progress_bar.empty()
                             
-                            for idx, file in enumerate(merge_files):
-                                status_text.text(f"Processing: {file.name}")
-                                progress_bar.progress((idx + 1) / len(merge_files))
-                                
-                                file_bytes = file.getvalue()
-                                src_wb = load_workbook(filename=BytesIO(file_bytes), data_only=False)
-                                src_ws = src_wb.active
-                                
-                                if not headers_copied:
-                                    for col, cell in enumerate(src_ws[1], start=1):
-                                        dst_cell = merged_ws.cell(current_row, col, cell.value)
-                                        copy_cell_style(cell, dst_cell)
-                                    current_row += 1
-                                    headers_copied = True
-                                
-                                for row in src_ws.iter_rows(min_row=2):
-                                    for col, cell in enumerate(row, start=1):
-                                        if cell.value is not None:
-                                            dst_cell = merged_ws.cell(current_row, col, cell.value)
-                                            copy_cell_style(cell, dst_cell)
-                                    current_row += 1
+                                out = save_workbook_to_temp(merged_wb)
                             
-                            if merge_files:
-                                first_file_bytes = merge_files[0].getvalue()
-                                first_wb = load_workbook(filename=BytesIO(first_file_bytes), data_only=False)
-                                first_ws = first_wb.active
-                                copy_column_widths(first_ws, merged_ws)
-                            
-                            status_text.empty()
-                            progress_bar.empty()
-                            
-                            out = BytesIO()
-                            merged_wb.save(out)
-                            out.seek(0)
-                            
-                            st.success("✅ Merge completed with preserved formatting")
-                            st.download_button(
-                                "⬇️ Download merged file",
-                                out.getvalue(),
-                                file_name="Merged_Consolidated_Formatted.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-                        else:
-                            all_dfs = []
-                            for file in merge_files:
-                                ext = file.name.split(".")[-1].lower()
-                                df = pd.read_csv(file) if ext == "csv" else pd.read_excel(file)
-                                all_dfs.append(df)
-                            merged_df = pd.concat(all_dfs, ignore_index=True)
-                            
-                            out = BytesIO()
-                            merged_df.to_excel(out, index=False, engine='openpyxl')
-                            out.seek(0)
-                            
-                            st.success("✅ Merge completed")
-                            st.download_button(
-                                "⬇️ Download file",
-                                out.getvalue(),
-                                file_name="Merged_Consolidated.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-                    except Exception as e:
-                        st.error(f"❌ Error while merging: {e}")
-    st.markdown('</div>', unsafe_allow_html=True)
+                                st.success("✅ Merge completed with preserved formatting")
+                                if merge_dedupe:
+                                    st.info(f"🧹 {dropped} duplicate rows removed; {merged_rows - 1} data rows kept.")
+                                st.download_button(
+                                    "⬇️ Download merged file",
+                                    download_data(out),
+                                    file_name="Merged_Consolidated_Formatted.xlsx",
+                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                                )
+                            else:
+                                as_csv = merge_format == "CSV (.csv)"
+                                csv_stats = []
+
+                                def _source(file):
+                                    data = file.getvalue()
+                                    if file.name.lower().endswith(".csv"):
+                                        csv_stats.append({})
+                                        # Text in, text out for CSV; typed values for an xlsx output
+                                        kwargs = {"dtype": str} if as_csv else {}
+                                        chunks = iter_csv_chunks(data, CSV_CHUNK_ROWS, csv_stats[-1], **kwargs)
+                                        return file.name, csv_columns(data), chunks
+                                    columns = sheet_columns(data)
+                                    return file.name, columns, iter_sheet_chunks(data, columns=columns)
+
+                                progress_bar = st.progress(0)
+                                status_text = st.empty()
+
+                                def _on_progress(done, total, name):
+                                    status_text.text(f"Merged {done}/{total}: {name}")
+                                    progress_bar.progress(done / total)
+
+                                # Header union first, then one chunk at a time straight to the output
+                                if as_csv:
+                                    with temp_output(".csv") as out_file:
+                                        merged_rows = merge_frames(out_file, [_source(f) for f in merge_files], True, _on_progress)
+                                    out = finish_temp_output(out_file)
+                                else:
+                                    merged_wb, merged_ws = new_output_workbook("Sheet1")
+                                    merged_rows = merge_frames(merged_ws, [_source(f) for f in merge_files], False, _on_progress)
+                                    out = save_workbook_to_temp(merged_wb)
+
+                                status_text.empty()
+                                progress_bar.empty()
+                                show_csv_stats(csv_stats)
+
+                                st.success(f"✅ Merge completed — {merged_rows:,} rows")
+                                st.download_button(
+                                    "⬇️ Download file",
+                                    download_data(out),
+                                    file_name="Merged_Consolidated.csv" if as_csv else "Merged_Consolidated.xlsx",
+                                    mime="text/csv" if as_csv else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                                )
+                        except Exception as e:
+                            st.error(f"❌ Error while merging: {e}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+merge_card()
 
 
 # ===================== Excel Processor Card =====================
-with st.container():
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.markdown("### 🧰 Excel Processor Service")
-    st.markdown('<span class="hint">Process Excel file: Update BUM column (L4 Emp Name) based on MR name, add ID Numbers from uploaded mapping file (appears at the end), and move CRM Interval Date to the beginning.</span>', unsafe_allow_html=True)
+def ensure_mappings(id_dict, bum_dict):
+    """Processing needs the mappings: wait for the first download if it hasn't finished."""
+    if DOCTOR_IDS.updated_at is None or BUM_MAPPING.updated_at is None:
+        with st.spinner("Loading mappings..."):
+            id_dict, _ = DOCTOR_IDS.get()
+            bum_dict, _ = BUM_MAPPING.get()
+    return id_dict, bum_dict
+
+@st.fragment
+def processor_card():
+    with st.container():
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("### 🧰 Excel Processor Service")
+        st.markdown('<span class="hint">Process Excel file: Update BUM column (L4 Emp Name) based on MR name, add ID Numbers from uploaded mapping file (appears at the end), and move CRM Interval Date to the beginning.</span>', unsafe_allow_html=True)
     
-    id_dict, id_message = load_online_doctor_ids()
-    st.info(id_message)
+        # Google Sheet mappings: one local store shared by all sessions, refreshed in the background
+        m1, m2 = st.columns([4, 1])
+        with m2:
+            if st.button("🔄 Refresh mappings", key="refresh_mappings"):
+                with st.spinner("Refreshing mappings..."):
+                    DOCTOR_IDS.refresh(force=True)
+                    BUM_MAPPING.refresh(force=True)
+        # Non-blocking: the first download runs in the background, processing waits for it
+        id_dict, id_message = DOCTOR_IDS.get(block=False)
+        bum_dict, bum_message = BUM_MAPPING.get(block=False)
+        with m1:
+            st.info(id_message)
+            if not bum_dict and BUM_MAPPING.error:
+                st.warning(f"⚠️ Could not load BUM mapping: {bum_message}")
+            elif not bum_dict:
+                st.info(bum_message)
     
-    proc_file = st.file_uploader(
-        "📂 Upload Excel file to process (xlsx/xlsm)",
-        type=["xlsx", "xlsm"],
-        accept_multiple_files=False,
-        key=f"processor_uploader_{st.session_state.clear_counter}",
-    )
-
-    bum_df = load_bum_mapping()
-    if not bum_df.empty:
-        bum_dict = dict(zip(bum_df['MR'], bum_df['BUM']))
-    else:
-        bum_dict = {}
-
-    COLUMN_RENAME_MAP = { 
-        "L1 Emp Name": "MR", 
-        "L2 Emp Name": "DM", 
-        "L3 Emp Name": "AM",
-        "L4 Emp Name": "BUM"
-    }
-
-    FINAL_COLUMN_ORDER = [
-        "CRM Interval Date",
-        "Tracking Number",
-        "MR",
-        "DM",
-        "AM",
-        "BUM",
-        "Line",
-        "Activity",
-        "Description",
-        "Account Number",
-        "Vendor",
-        "Bank",
-        "Cost",
-        "Bricks",
-        "Professionl Accounts",
-        "Request Professionals",
-        "Specialities",
-        "Request Date",
-    ]
-
-    if proc_file:
-        st.write("**File:**", proc_file.name)
-        
-        if id_dict:
-            st.info("📊 Preview of uploaded file (first 5 rows):")
-            try:
-                sample_df = pd.read_excel(proc_file, nrows=5)
-                st.dataframe(sample_df, use_container_width=True)
-            except:
-                pass
+        batch_mode = st.toggle("📦 Batch mode (many files or a ZIP)", key="processor_batch")
+        if batch_mode:
+            proc_file = None
+            proc_files = st.file_uploader(
+                "📂 Upload Excel files to process (xlsx/xlsm, or a ZIP of them)",
+                type=["xlsx", "xlsm", "zip"],
+                accept_multiple_files=True,
+                key=f"processor_batch_uploader_{card_counter('processor')}",
+            )
+        else:
+            proc_files = []
+            proc_file = st.file_uploader(
+                "📂 Upload Excel file to process (xlsx/xlsm)",
+                type=["xlsx", "xlsm"],
+                accept_multiple_files=False,
+                key=f"processor_uploader_{card_counter('processor')}",
+            )
+
+        if proc_file:
+            st.write("**File:**", proc_file.name)
         
-        if st.button("⚙️ Start processing"):
+            if id_dict:
+                st.info("📊 Preview of uploaded file (first 5 rows):")
+                try:
+                    sample_df = sheet_preview(proc_file.getvalue(), nrows=5)
+                    st.dataframe(sample_df, use_container_width=True)
+                except:
+                    pass
+
+        if proc_files:
+            display_uploaded_files(proc_files, "Files")
+
+        if proc_file or proc_files:
+            proc_mode = st.radio(
+                "Processing mode",
+                ["Full formatting", "Fast (columnar)"],
+                horizontal=True,
+                key="processor_mode",
+                help="Full formatting copies the style of every cell. Fast does the BUM / ID lookups as column operations and gives each column the style of its first data row.",
+            )
+            fuzzy_threshold = st.slider(
+                "Doctor name match threshold",
+                min_value=0.70, max_value=1.0, value=FUZZY_THRESHOLD, step=0.01,
+                key="fuzzy_threshold",
+                help="Names are compared after normalization (case, Arabic letters/diacritics, spaces, Dr./د. titles). Below 1.0, names without an exact match are matched to the most similar doctor scoring at least this much.",
+            )
+            proc_workers = default_workers()
+            incremental = False
+            if proc_file:
+                incremental = st.checkbox(
+                    "♻️ Incremental (reuse lookups for rows unchanged since the last run)",
+                    key="processor_incremental",
+                    help="Rows whose values are identical to a row of the last processed export of the same dataset (with the same columns) reuse its BUM / ID Number. The saved rows are discarded when the mappings or the match threshold change.",
+                )
+                if incremental:
+                    manifest_dataset = st.text_input(
+                        "Dataset name",
+                        value=re.sub(r"[\s_\-.]*[\d\-_.]+$", "", os.path.splitext(proc_file.name)[0]) or "default",
+                        key="processor_dataset",
+                        help="Exports processed under the same name are compared with each other. Only the most recent run of each dataset is kept, and it is shared by everyone using this server: use a name of your own (e.g. region + your name).",
+                    )
+            if proc_files:
+                proc_workers = st.number_input(
+                    "Parallel workers (1 = serial)",
+                    min_value=1,
+                    max_value=default_workers(),
+                    value=default_workers(),
+                    key="processor_workers",
+                )
+
+        if proc_file and st.button("⚙️ Start processing"):
             try:
-                wb = load_workbook(proc_file, data_only=False)
-                ws = wb.active
-                
-                headers = [ws.cell(1, col).value for col in range(1, ws.max_column + 1)]
-                header_to_idx = {h: i+1 for i, h in enumerate(headers) if h is not None}
-                
-                new_wb = Workbook()
-                new_ws = new_wb.active
-                new_ws.title = "Processed_Data"
-                
-                mr_col_idx = None
-                bum_col_idx = None
-                crm_interval_idx = None
-                doctor_name_col_idx = None
-                
-                for old_name, new_name in COLUMN_RENAME_MAP.items():
-                    if old_name in header_to_idx:
-                        if new_name == "MR":
-                            mr_col_idx = header_to_idx[old_name]
-                        elif new_name == "BUM":
-                            bum_col_idx = header_to_idx[old_name]
-                
-                # البحث عن عمود اسم الدكتور - نبحث تحديداً عن "Professionl Accounts"
+                id_dict, bum_dict = ensure_mappings(id_dict, bum_dict)
+                id_match = id_dict.matcher(fuzzy_threshold)
+                manifest = None
+                if incremental:
+                    manifest = RowManifest(
+                        STORE, f"{DOCTOR_IDS.version}:{BUM_MAPPING.version}:{fuzzy_threshold}",
+                        dataset=manifest_dataset,
+                    )
+                new_wb, report = process_workbook(
+                    proc_file, bum_dict, id_match,
+                    columnar=proc_mode == "Fast (columnar)", manifest=manifest,
+                )
+
                 st.write("**Searching for doctor name column in uploaded file:**")
-                for col_name in headers:
-                    if col_name:
-                        col_name_str = str(col_name).strip()
-                        # البحث عن العمود المطلوب بالضبط
-                        if col_name_str == "Professionl Accounts":
-                            doctor_name_col_idx = header_to_idx[col_name]
-                            st.write(f"✅ Found exact match: '{col_name}' at position {doctor_name_col_idx}")
-                            break
-                        # البحث عن أي عمود يحتوي على الكلمات المفتاحية
-                        elif any(keyword in col_name_str.lower() for keyword in ['professionl', 'professional', 'account', 'doctor', 'name']):
-                            doctor_name_col_idx = header_to_idx[col_name]
-                            st.write(f"⚠️ Found potential doctor name column: '{col_name}' at position {doctor_name_col_idx}")
-                
-                if not doctor_name_col_idx:
+                for note in report['notes']:
+                    st.write(note)
+                if not report['doctor_col']:
                     st.warning("⚠️ Could not find 'Professionl Accounts' column in the uploaded file. ID Numbers will not be added.")
-                
-                for col_name in headers:
-                    if col_name and "CRM Interval Date" in str(col_name):
-                        crm_interval_idx = header_to_idx[col_name]
-                        break
-                
-                final_cols_info = []
-                
-                if crm_interval_idx:
-                    final_cols_info.append({
-                        'name': 'CRM Interval Date',
-                        'type': 'existing',
-                        'source_col': crm_interval_idx,
-                        'original_name': headers[crm_interval_idx - 1]
-                    })
-                else:
-                    final_cols_info.append({
-                        'name': 'CRM Interval Date',
-                        'type': 'new',
-                        'value': ''
-                    })
-                
-                for col_name in FINAL_COLUMN_ORDER[1:]:
-                    if col_name == "BUM" and bum_col_idx:
-                        final_cols_info.append({
-                            'name': 'BUM',
-                            'type': 'bum',
-                            'source_col': bum_col_idx,
-                            'mr_col': mr_col_idx
-                        })
-                    else:
-                        found = False
-                        for old_name, new_name in COLUMN_RENAME_MAP.items():
-                            if col_name == new_name and old_name in header_to_idx:
-                                final_cols_info.append({
-                                    'name': col_name,
-                                    'type': 'existing',
-                                    'source_col': header_to_idx[old_name],
-                                    'original_name': old_name
-                                })
-                                found = True
-                                break
-                        
-                        if not found and col_name in header_to_idx:
-                            final_cols_info.append({
-                                'name': col_name,
-                                'type': 'existing',
-                                'source_col': header_to_idx[col_name],
-                                'original_name': col_name
-                            })
-                
-                # إضافة عمود ID Number في النهاية
-                if id_dict and doctor_name_col_idx:
-                    final_cols_info.append({
-                        'name': 'ID Number',
-                        'type': 'id_number',
-                        'doctor_col': doctor_name_col_idx
-                    })
-                    st.info(f"✅ ID Number column will be added at the end. Found {len(id_dict)//2} doctor IDs in mapping.")
-                
-                for col_idx, col_info in enumerate(final_cols_info, start=1):
-                    new_ws.cell(1, col_idx, col_info['name'])
-                    if col_info.get('source_col'):
-                        src_cell = ws.cell(1, col_info['source_col'])
-                        dst_cell = new_ws.cell(1, col_idx)
-                        copy_cell_style(src_cell, dst_cell)
-                
-                matched_count = 0
-                unmatched_doctors = []
-                
-                for row_idx in range(2, ws.max_row + 1):
-                    for col_idx, col_info in enumerate(final_cols_info, start=1):
-                        if col_info['type'] == 'new':
-                            new_ws.cell(row_idx, col_idx, '')
-                        
-                        elif col_info['type'] == 'id_number':
-                            if col_info.get('doctor_col'):
-                                doctor_name = ws.cell(row_idx, col_info['doctor_col']).value
-                                if doctor_name:
-                                    clean_name = str(doctor_name).strip()
-                                    found_id = None
-                                    
-                                    if clean_name in id_dict:
-                                        found_id = id_dict[clean_name]
-                                    elif clean_name.lower() in id_dict:
-                                        found_id = id_dict[clean_name.lower()]
-                                    elif clean_name.replace(" ", "") in id_dict:
-                                        found_id = id_dict[clean_name.replace(" ", "")]
-                                    
-                                    if found_id:
-                                        new_ws.cell(row_idx, col_idx, found_id)
-                                        matched_count += 1
-                                    else:
-                                        new_ws.cell(row_idx, col_idx, '')
-                                        if clean_name not in unmatched_doctors:
-                                            unmatched_doctors.append(clean_name)
-                                else:
-                                    new_ws.cell(row_idx, col_idx, '')
-                            else:
-                                new_ws.cell(row_idx, col_idx, '')
-                        
-                        elif col_info['type'] == 'bum':
-                            src_cell = ws.cell(row_idx, col_info['source_col'])
-                            if col_info.get('mr_col'):
-                                mr_value = ws.cell(row_idx, col_info['mr_col']).value
-                                if mr_value and str(mr_value).strip() in bum_dict:
-                                    new_value = bum_dict[str(mr_value).strip()]
-                                    dst_cell = new_ws.cell(row_idx, col_idx, new_value)
-                                else:
-                                    dst_cell = new_ws.cell(row_idx, col_idx, src_cell.value)
-                            else:
-                                dst_cell = new_ws.cell(row_idx, col_idx, src_cell.value)
-                            copy_cell_style(src_cell, dst_cell)
-                        
-                        else:
-                            src_col = col_info['source_col']
-                            src_cell = ws.cell(row_idx, src_col)
-                            dst_cell = new_ws.cell(row_idx, col_idx, src_cell.value)
-                            copy_cell_style(src_cell, dst_cell)
-                
-                if id_dict and doctor_name_col_idx:
-                    total_doctors = ws.max_row - 1
+
+                matched_count = report['matched']
+                total_doctors = report['rows']
+                if report['with_ids']:
+                    st.info(f"✅ ID Number column added at the end. Found {len(id_dict)} doctor IDs in mapping.")
                     if matched_count > 0:
                         st.success(f"✅ Matched {matched_count} out of {total_doctors} doctors with ID numbers")
+                        if report['fuzzy']:
+                            with st.expander(f"🔎 {len(report['fuzzy'])} names matched approximately — review"):
+                                st.dataframe(pd.DataFrame(
+                                    [(name, master, round(score, 2)) for name, (master, score) in report['fuzzy'].items()],
+                                    columns=["Name in file", "Matched doctor", "Score"],
+                                ), use_container_width=True)
                     else:
                         st.warning(f"⚠️ No matches found! Checked {total_doctors} doctors. Sample of names from 'Professionl Accounts' column:")
-                        sample_unmatched = unmatched_doctors[:10]
+                        sample_unmatched = report['unmatched'][:10]
                         for name in sample_unmatched:
                             st.write(f"- '{name}'")
-                        st.info("Make sure the names in your ID file match exactly with these names (spaces, spelling).")
-                
-                for col_idx, col_info in enumerate(final_cols_info, start=1):
-                    if col_info.get('source_col'):
-                        src_col_letter = get_column_letter(col_info['source_col'])
-                        if src_col_letter in ws.column_dimensions:
-                            width = ws.column_dimensions[src_col_letter].width
-                            if width:
-                                new_ws.column_dimensions[get_column_letter(col_idx)].width = width
-                    else:
-                        new_ws.column_dimensions[get_column_letter(col_idx)].width = 15
-                
-                out_buf = BytesIO()
-                new_wb.save(out_buf)
-                out_buf.seek(0)
-                
+                        st.info("Make sure the names in your ID file match these names (spelling), or lower the match threshold.")
+
+                diff = report['incremental']
+                if diff and diff['reused_manifest']:
+                    st.info(
+                        f"♻️ Since the last run: {diff['unchanged']} rows unchanged (lookups reused), "
+                        f"{diff['changed']} new or edited, {diff['removed']} previous rows edited or removed."
+                    )
+                elif diff:
+                    st.info(f"♻️ No previous run of dataset '{manifest_dataset}' with these columns, mappings and threshold: all rows were looked up and saved for next time.")
+
+                out_buf = save_workbook_to_temp(new_wb)
+            
                 success_msg = "✅ Processing completed: "
                 if bum_dict:
                     success_msg += "BUM column updated, "
-                if id_dict and doctor_name_col_idx:
+                if report['with_ids']:
                     success_msg += f"ID Numbers added ({matched_count} matched), "
                 success_msg += "and CRM Interval Date moved to beginning"
-                
+            
                 st.success(success_msg)
                 base = os.path.splitext(proc_file.name)[0]
                 st.download_button(
                     "⬇️ Download processed file",
-                    out_buf.getvalue(),
+                    download_data(out_buf),
                     file_name=f"{_safe_name(base)}_processed.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
-                
+            
             except Exception as e:
                 st.error(f"❌ Error while processing: {e}")
                 st.exception(e)
-    st.markdown('</div>', unsafe_allow_html=True)
+
+        if proc_files and st.button("⚙️ Process all files", key="process_batch"):
+            try:
+                id_dict, bum_dict = ensure_mappings(id_dict, bum_dict)
+                inputs = list(batch_inputs(proc_files))
+                if not inputs:
+                    st.warning("⚠️ No .xlsx / .xlsm files found in the upload.")
+                else:
+                    # Mappings are resolved once here; workers get the store path, not the rows
+                    tasks = [
+                        (name, data, bum_dict, id_dict, fuzzy_threshold, proc_mode == "Fast (columnar)")
+                        for name, data in inputs
+                    ]
+                    progress_bar = st.progress(0.0)
+                    status_text = st.empty()
+                    summary = []
+                    used_names = set()
+                    # xlsx files are already deflated: store them as-is
+                    with temp_output(".zip") as zip_out, ZipFile(zip_out, "w", ZIP_STORED) as zip_file:
+                        for i, (name, data, report) in enumerate(
+                            run_parallel(process_batch_file, tasks, int(proc_workers))
+                        ):
+                            progress_bar.progress((i + 1) / len(tasks))
+                            status_text.text(f"Processed {i + 1}/{len(tasks)}: {name}")
+                            if data is None:
+                                summary.append({"File": name, "Error": report['error']})
+                                continue
+                            base = _safe_name(os.path.splitext(name)[0])
+                            out_name, n = f"{base}_processed.xlsx", 1
+                            while out_name in used_names:
+                                n += 1
+                                out_name = f"{base}_processed_{n}.xlsx"
+                            used_names.add(out_name)
+                            zip_file.writestr(out_name, data)
+                            summary.append({
+                                "File": name,
+                                "Rows": report['rows'],
+                                "IDs matched": report['matched'] if report['with_ids'] else None,
+                                "Match rate": round(report['matched'] / report['rows'], 4) if report['with_ids'] and report['rows'] else None,
+                                "Approx. matches": len(report['fuzzy']),
+                                "Unmatched names": len(report['unmatched']),
+                                "Error": "" if report['with_ids'] else "No doctor name column / ID mapping",
+                            })
+                        summary_df = pd.DataFrame(summary)
+                        zip_file.writestr(
+                            "_summary.csv",
+                            summary_df.to_csv(index=False).encode("utf-8-sig"),
+                            compress_type=ZIP_DEFLATED,
+                        )
+                    zip_reader = finish_temp_output(zip_out)
+                    status_text.empty()
+                    progress_bar.empty()
+
+                    done = summary_df[summary_df["Rows"].notna()] if "Rows" in summary_df else summary_df.iloc[0:0]
+                    total_rows = int(done["Rows"].sum()) if len(done) else 0
+                    total_matched = int(done["IDs matched"].fillna(0).sum()) if len(done) else 0
+                    rate = f" ({total_matched / total_rows:.1%})" if total_rows else ""
+                    st.success(
+                        f"✅ Processed {len(done)} of {len(tasks)} files: {total_rows} rows, "
+                        f"{total_matched} doctors matched with ID numbers{rate}"
+                    )
+                    st.dataframe(summary_df, use_container_width=True)
+                    st.download_button(
+                        "⬇️ Download processed files (ZIP)",
+                        download_data(zip_reader),
+                        file_name="processed_files.zip",
+                        mime="application/zip"
+                    )
+            except Exception as e:
+                st.error(f"❌ Error while processing: {e}")
+                st.exception(e)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+processor_card()
 
 
 # ===================== Images → PDF Card =====================
-with st.container():
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.markdown("### 🖼️ Convert Images to PDF")
-    st.markdown('<span class="hint">Upload one or more images and they will be combined into a single PDF file while preserving original quality.</span>', unsafe_allow_html=True)
-
-    uploaded_images = st.file_uploader(
-        "📂 Upload JPG/PNG images",
-        type=["jpg", "jpeg", "png"],
-        accept_multiple_files=True,
-        key=f"image_uploader_{st.session_state.clear_counter}",
-    )
-
-    if uploaded_images:
-        display_uploaded_files(uploaded_images, "Images")
-        c1, c2 = st.columns([1,1])
-        with c1:
-            if st.button("🧹 Clear images", key="clear_images"):
-                st.session_state.clear_counter += 1
-                st.rerun()
-        with c2:
-            if st.button("🖨️ Create PDF"):
-                with st.spinner("Creating PDF..."):
-                    try:
-                        progress_bar = st.progress(0)
+@st.fragment
+def images_card():
+    with st.container():
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("### 🖼️ Convert Images to PDF")
+        st.markdown('<span class="hint">Upload one or more images and they will be combined into a single PDF file while preserving original quality.</span>', unsafe_allow_html=True)
+
+        uploaded_images = st.file_uploader(
+            "📂 Upload JPG/PNG images",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+            key=f"image_uploader_{card_counter('images')}",
+        )
+
+        if uploaded_images:
+            display_uploaded_files(uploaded_images, "Images")
+            c1, c2 = st.columns([1,1])
+            with c1:
+                if st.button("🧹 Clear images", key="clear_images"):
+                    clear_card("images")
+            with c2:
+                if st.button("🖨️ Create PDF"):
+                    with st.spinner("Creating PDF..."):
+                        try:
+                            progress_bar = st.progress(0)
                         
-                        images = []
-                        for i, img_file in enumerate(uploaded_images):
-                            img = Image.open(img_file)
-                            if img.mode != 'RGB':
-                                img = img.convert('RGB')
-                            images.append(img)
-                            progress_bar.progress((i + 1) / len(uploaded_images))
+                            images = []
+                            for i, img_file in enumerate(uploaded_images):
+                                from PIL import Image  # only this card needs Pillow
+                                img = Image.open(img_file)
+                                if img.mode != 'RGB':
+                                    img = img.convert('RGB')
+                                images.append(img)
+                                progress_bar.progress((i + 1) / len(uploaded_images))
                         
-                        pdf_buffer = BytesIO()
-                        images[0].save(
-                            pdf_buffer,
-                            format="PDF",
-                            save_all=True,
-                            append_images=images[1:],
-                            quality=95
-                        )
-                        pdf_buffer.seek(0)
+                            pdf_buffer = BytesIO()
+                            images[0].save(
+                                pdf_buffer,
+                                format="PDF",
+                                save_all=True,
+                                append_images=images[1:],
+                                quality=95
+                            )
+                            pdf_buffer.seek(0)
                         
-                        progress_bar.empty()
-                        st.success("✅ PDF created successfully")
-                        st.download_button(
-                            "⬇️ Download PDF",
-                            pdf_buffer.getvalue(),
-                            file_name="Images_Combined.pdf",
-                            mime="application/pdf"
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Error while creating PDF: {e}")
-    st.markdown('</div>', unsafe_allow_html=True)
+                            progress_bar.empty()
+                            st.success("✅ PDF created successfully")
+                            st.download_button(
+                                "⬇️ Download PDF",
+                                pdf_buffer.getvalue(),
+                                file_name="Images_Combined.pdf",
+                                mime="application/pdf"
+                            )
+                        except Exception as e:
+                            st.error(f"❌ Error while creating PDF: {e}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+images_card()
 
 # Footer
 st.markdown("<hr>", unsafe_allow_html=True)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: per-card isolation.
+Uploads a workbook to the Split card and an image to the Images card,
+empties Streamlit's caches, then clicks "Create PDF". The click must not
+re-read the Split card's workbook (each card is its own st.fragment).
+Exits 1 if the click re-read a workbook, or if the Split card never read it
+(the probe would then prove nothing).
+
+AppTest always re-runs the whole script, so the click is sent the way the
+browser sends it: as a rerun scoped to the Images card's fragment id.
+
+Run from the repo root:  python benchmarks/bench_card_isolation.py
+"""
+
+import contextlib
+import dataclasses
+import os
+import sys
+import time
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+import streamlit as st
+from openpyxl import Workbook
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import local_script_runner
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import xlsx_package  # noqa: E402
+
+ROWS = 50_000
+
+# The Split card lists sheets and previews through xlsx_package; the full
+# openpyxl / pandas reads only happen on "Start"
+calls = {"load_workbook": 0, "read_excel": 0, "workbook_sheets": 0, "sheet_preview": 0}
+
+
+def _counting(module, name):
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return original(*args, **kwargs)
+    setattr(module, name, wrapper)
+
+
+@contextlib.contextmanager
+def _scoped_to(fragment_id):
+    """
+    Make AppTest runs fragment-scoped reruns (as the frontend sends them).
+    Both the runner's initial request and the click request are scoped, or
+    the two get coalesced into a full-app rerun.
+    """
+    rerun_data = local_script_runner.RerunData
+
+    def scoped(**kwargs):
+        return dataclasses.replace(
+            rerun_data(**kwargs),
+            fragment_id_queue=[fragment_id],
+            is_fragment_scoped_rerun=True,
+        )
+    local_script_runner.RerunData = scoped
+    try:
+        yield
+    finally:
+        local_script_runner.RerunData = rerun_data
+
+
+def _xlsx_bytes():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["MR", "Tracking Number", "Cost"])
+    for i in range(ROWS):
+        ws.append([f"MR {i % 50}", i, i * 1.5])
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _png_bytes():
+    buf = BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def main():
+    os.chdir(ROOT)
+    os.environ.setdefault("TFE_OFFLINE", "1")
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    at.run()
+
+    at.file_uploader(key="split_uploader_0").set_value(("big.xlsx", _xlsx_bytes(), "application/octet-stream"))
+    at.file_uploader(key="image_uploader_0").set_value(("img.png", _png_bytes(), "image/png"))
+    start = time.perf_counter()
+    at.run()
+    full_s = time.perf_counter() - start
+    assert not at.exception, at.exception
+
+    # Nothing cached any more: a re-run of the Split card would parse again
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    _counting(openpyxl, "load_workbook")
+    _counting(pd, "read_excel")
+    _counting(xlsx_package, "workbook_sheets")
+    _counting(xlsx_package, "sheet_preview")
+
+    # Sanity check: a full-app rerun reads the workbook with the counters in place
+    at.run()
+    assert not at.exception, at.exception
+    full_rerun_reads = dict(calls)
+    if not any(full_rerun_reads.values()):
+        print("❌ a full-app rerun read no workbook: the counters miss the Split card")
+        sys.exit(1)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    calls.update(dict.fromkeys(calls, 0))
+
+    # Cards register their fragments in page order: Images is the last one
+    images_fragment = list(at._fragment_storage._fragments)[-1]
+    start = time.perf_counter()
+    with _scoped_to(images_fragment):
+        next(b for b in at.button if b.label == "🖨️ Create PDF").click().run()
+    click_s = time.perf_counter() - start
+    assert not at.exception, at.exception
+
+    print(f"full run with uploads        {full_s:6.2f} s")
+    print(f"'Create PDF' click           {click_s:6.2f} s")
+    print("workbook reads, full rerun   ", " ".join(f"{k}={v}" for k, v in full_rerun_reads.items()))
+    print("workbook reads during click  ", " ".join(f"{k}={v}" for k, v in calls.items()))
+    if any(calls.values()):
+        print("❌ image-card click re-ran the Split card")
+        sys.exit(1)
+    print("✅ image-card click did not touch the Split card")
+
+
+if __name__ == "__main__":
+    main()
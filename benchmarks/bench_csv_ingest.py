@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: CSV ingestion (csv_ingest) on a CRM-style export.
+- whole-file read (C parser)
+- chunked all-text read (C parser), as used by the streaming split and
+  CSV merge
+for a UTF-8 comma file and a Windows-1256 semicolon file.
+
+Run from the repo root:  python benchmarks/bench_csv_ingest.py [rows]
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csv_ingest import iter_csv_chunks, read_csv_frame  # noqa: E402
+from excel_engine import CSV_CHUNK_ROWS, default_workers  # noqa: E402
+
+
+def make_export(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "Tracking Number": rng.integers(10**6, 10**7, rows),
+        "MR": rng.choice(["أحمد علي", "منى حسن", "Mohamed Omar"], rows),
+        "CRM Interval Date": rng.choice(["2024-01-05", "2024-02-01", "2024-03-11"], rows),
+        "Cost": rng.random(rows).round(2),
+        "Professionl Accounts": rng.choice(["د. سامي", "Dr. Ali", "Dr. Mona"], rows),
+    })
+
+
+def _report(label, stats):
+    rate = stats["rows"] / stats["seconds"]
+    print(f"  {label:<28} {stats['seconds']:6.2f} s  {rate:12,.0f} rows/s  "
+          f"({stats['engine']}, {stats['encoding']}, {stats['delimiter']!r})")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = make_export(rows)
+    print(f"{rows:,} rows, {default_workers()} CPU(s)\n")
+    for encoding, sep in (("utf-8", ","), ("cp1256", ";")):
+        data = df.to_csv(index=False, sep=sep).encode(encoding)
+        print(f"{encoding} / {sep!r}  ({len(data) / 1e6:.0f} MB)")
+        stats = {}
+        read_csv_frame(data, stats=stats)
+        _report("whole file, C parser", stats)
+        stats = {}
+        for _chunk in iter_csv_chunks(data, CSV_CHUNK_ROWS, stats, dtype=str):
+            pass
+        _report("text chunks, C parser", stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Check + benchmark: split grouping.
+- check: `match_keys` puts two cells in the same group exactly when the
+  original per-value comparison (`_is_match`, kept here as the reference)
+  matched them, on tricky values (spaces, case, 7 vs "7.0", -0, Arabic,
+  "nan", empty cells). Exits 1 on a difference.
+  Known, deliberate exception: booleans. `_is_match` matches True with both
+  1 and "true" but not 1 with "true", which no grouping can reproduce;
+  `match_keys` groups True with 1.
+- timing: one `_is_match` scan per distinct value (the previous Split card
+  loop) vs. `match_keys` + `group_positions`
+
+Run from the repo root:  python benchmarks/bench_match_keys.py [rows]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_engine import group_positions, match_keys  # noqa: E402
+
+TRICKY = [
+    "MR 5", " mr 5 ", "MR 5 ", "Mr 5", 7, 7.0, "7", "7.0", " 7 ", "07", 1, "1",
+    None, "", "  ", "nan", "NaN", 1.5, "1.50", "1e3", 1000, "١٢", "أحمد", "أحمد ",
+    "ahmed", "AHMED", "inf", float("inf"), -0.0, 0, "0", "-0",
+]
+
+
+def _is_match(cell_value, target_value):
+    """The Split card's original cell comparison (numbers by value, text stripped + case-insensitive)."""
+    if cell_value is None and target_value is None:
+        return True
+    if cell_value is None or target_value is None:
+        return False
+    str_cell = str(cell_value).strip()
+    str_target = str(target_value).strip()
+    if str_cell == str_target:
+        return True
+    try:
+        if float(cell_value) == float(target_value):
+            return True
+    except (ValueError, TypeError):
+        pass
+    return str_cell.lower() == str_target.lower()
+
+
+def _differences(series):
+    keys = match_keys(series)
+    cells = [None if not isinstance(v, str) and pd.isna(v) else v for v in series]
+    found = []
+    for i, cell in enumerate(cells):
+        for j, target in enumerate(cells):
+            if target is None:
+                continue  # empty cells never form a group
+            same_group = keys[i] is not pd.NA and keys[i] == keys[j]
+            if _is_match(cell, target) != same_group:
+                found.append((cell, target, keys[i], keys[j]))
+    return found
+
+
+def check():
+    cases = {
+        "mixed (object)": pd.Series(TRICKY, dtype=object),
+        "numbers": pd.Series([v for v in TRICKY if isinstance(v, (int, float)) and v is not None]),
+        "text": pd.Series([v for v in TRICKY if isinstance(v, str)]),
+    }
+    ok = True
+    for label, series in cases.items():
+        found = _differences(series)
+        print(f"  {label:<16} {len(series):3d} values  {len(found)} differences")
+        for cell, target, key, target_key in found[:10]:
+            print(f"    {cell!r} vs {target!r}: keys {key} / {target_key}")
+        ok = ok and not found
+    return ok
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    print("grouping matches _is_match:")
+    ok = check()
+
+    rng = np.random.default_rng(0)
+    column = pd.Series(rng.choice([f"MR {i}" for i in range(50)] + [" mr 5 ", 7, "7.0", None], rows), dtype=object)
+    start = time.perf_counter()
+    for value in column.dropna().unique():
+        [i for i, cell in enumerate(column) if _is_match(None if cell is None else cell, value)]
+    scan_s = time.perf_counter() - start
+    start = time.perf_counter()
+    group_positions(match_keys(column))
+    keys_s = time.perf_counter() - start
+    print(f"\n{rows:,} rows: _is_match scan per value {scan_s:7.2f} s, match_keys {keys_s:7.3f} s")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
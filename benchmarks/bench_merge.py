@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: merging many styled regional xlsx files.
+- sequential: full load_workbook per file + cell-by-cell style copy
+  (the previous Merge card path, which also re-read the first file)
+- merge_workbooks: read-only parse into row payloads in worker processes,
+  appended in upload order
+- merge_workbooks sorted by a column: sorted runs spilled to disk, then a
+  k-way heap merge
+
+Run from the repo root:  python benchmarks/bench_merge.py [files] [rows per file]
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl import Workbook, load_workbook  # noqa: E402
+from openpyxl.styles import Font, PatternFill  # noqa: E402
+from excel_engine import default_workers, merge_workbooks, new_output_workbook, new_style_cache  # noqa: E402
+from previous_paths import append_styled_row, copy_column_widths  # noqa: E402
+
+HEADERS = ["Tracking Number", "MR", "Line", "CRM Interval Date", "Cost", "Professionl Accounts"]
+
+
+def make_region(region, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill("solid", fgColor="FFDDEEFF")
+    ws.column_dimensions["F"].width = 30
+    for i in range(rows):
+        ws.append([region * 10**6 + i, f"MR {i % 40}", "Line", "2024-01", i * 1.5, f"Dr Name {i % 500}"])
+        ws.cell(row=i + 2, column=5).number_format = "#,##0.00"
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def sequential(sources):
+    merged_wb, merged_ws = new_output_workbook("Merged_Data")
+    style_cache = new_style_cache()
+    for idx, (_name, data) in enumerate(sources):
+        src_ws = load_workbook(BytesIO(data), data_only=False).active
+        if idx == 0:
+            copy_column_widths(src_ws, merged_ws)
+            append_styled_row(merged_ws, src_ws[1], style_cache, skip_empty=True)
+        for row in src_ws.iter_rows(min_row=2):
+            append_styled_row(merged_ws, row, style_cache, skip_empty=True)
+    merged_wb.save(BytesIO())
+
+
+def parallel(workers, sort_column=None):
+    def run(sources):
+        merged_wb, merged_ws = new_output_workbook("Merged_Data")
+        merge_workbooks(merged_ws, sources, workers=workers, sort_column=sort_column)
+        merged_wb.save(BytesIO())
+    return run
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    sources = [(f"region_{i}.xlsx", make_region(i, rows)) for i in range(files)]
+    print(f"{files} files x {rows:,} rows, {default_workers()} CPU(s)\n")
+    runs = [("sequential full load", sequential)]
+    runs += [(f"merge_workbooks, {w} worker(s)", parallel(w)) for w in sorted({1, default_workers()})]
+    runs += [(f"  sorted by doctor, {w} worker(s)", parallel(w, "Professionl Accounts"))
+             for w in sorted({1, default_workers()})]
+    for label, func in runs:
+        start = time.perf_counter()
+        func(sources)
+        print(f"{label:<35} {time.perf_counter() - start:7.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: upload -> sheet list + preview for the Split card.
+- previous path: full load_workbook (styles) for the sheet names, then
+  pd.read_excel of the whole selected sheet
+- xlsx_package: sheet names/dimensions from workbook.xml, then only the
+  first PREVIEW_ROWS rows of the sheet XML
+
+Run from the repo root:  python benchmarks/bench_preview.py [rows]
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl import Workbook, load_workbook  # noqa: E402
+from xlsx_package import PREVIEW_ROWS, sheet_preview, workbook_sheets  # noqa: E402
+
+HEADERS = ["Tracking Number", "MR", "Line", "CRM Interval Date", "Cost", "Professionl Accounts"]
+
+
+def make_workbook(rows):
+    wb = Workbook(write_only=True)
+    for title in ("Data", "Summary"):
+        ws = wb.create_sheet(title)
+        ws.append(HEADERS)
+        for i in range(rows if title == "Data" else 100):
+            ws.append([10**6 + i, f"MR {i % 40}", "Line", "2024-01", i * 1.5, f"Dr Name {i % 5000}"])
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def previous(data):
+    names = load_workbook(BytesIO(data), data_only=False).sheetnames
+    return pd.read_excel(BytesIO(data), sheet_name=names[0]).head(PREVIEW_ROWS)
+
+
+def inspector(data):
+    name = workbook_sheets(data)[0][0]
+    return sheet_preview(data, name)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    data = make_workbook(rows)
+    print(f"{rows:,} rows, {len(data) / 1e6:.0f} MB\n")
+    for label, func in (("full load + read_excel", previous), ("workbook.xml + preview rows", inspector)):
+        start = time.perf_counter()
+        frame = func(data)
+        print(f"{label:<30} {time.perf_counter() - start:8.3f} s  {frame.shape}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: Excel Processor on CRM-style exports of growing size.
+Each size and mode runs in a fresh process so peak RSS is per run.
+- full:     per-cell styles, read-only rows in / write-only rows out
+            (time should grow linearly, memory stay flat)
+- columnar: pandas column operations, one style per column
+
+Run from the repo root:  python benchmarks/bench_processor.py [rows ...]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HEADERS = ["Tracking Number", "L1 Emp Name", "L2 Emp Name", "L3 Emp Name", "L4 Emp Name",
+           "Line", "CRM Interval Date", "Cost", "Professionl Accounts", "Request Date"]
+
+
+def make_export(path, rows):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    ws.column_dimensions["I"].width = 30
+    ws.append(HEADERS)
+    for i in range(rows):
+        ws.append([i, f"MR {i % 400}", f"DM {i % 40}", f"AM {i % 8}", "BUM",
+                   "Line", "2024-01", i * 1.5, f"Dr Name {i % 5000}", "2024-01-15"])
+    wb.save(path)
+
+
+def run_once(path, mode):
+    from processor import process_workbook
+    from name_match import NameIndex
+
+    id_dict = NameIndex((f"Dr Name {i}", str(10**9 + i)) for i in range(0, 5000, 2))
+    bum_dict = {f"MR {i}": f"BUM {i % 5}" for i in range(400)}
+    start = time.perf_counter()
+    out_wb, report = process_workbook(path, bum_dict, id_dict.matcher(1.0), columnar=mode == "columnar")
+    count, matched = report['rows'], report['matched']
+    with tempfile.TemporaryFile() as fh:
+        out_wb.save(fh)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:<9} {count:>9,} rows  {elapsed:7.2f} s  {count / elapsed:9,.0f} rows/s  "
+          f"peak RSS {peak:6.0f} MB  ({matched:,} IDs matched)")
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run_once(sys.argv[2], sys.argv[3])
+        return
+    sizes = [int(a) for a in sys.argv[1:]] or [50_000, 100_000, 200_000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            path = os.path.join(tmp, f"crm_{rows}.xlsx")
+            make_export(path, rows)
+            for mode in ("full", "columnar"):
+                subprocess.run([sys.executable, os.path.abspath(__file__), "--run", path, mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: "Split Each Sheet into Separate File" on a styled workbook.
+- cell copy: full load_workbook, then every cell + style copied into a new
+  Workbook per sheet (the previous Split card path)
+- split_sheet_packages: each output cut from the original package at the
+  ZIP level, parts copied still compressed
+
+Run from the repo root:  python benchmarks/bench_split_sheets.py [sheets] [rows per sheet]
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl import Workbook, load_workbook  # noqa: E402
+from openpyxl.formatting.rule import CellIsRule  # noqa: E402
+from openpyxl.styles import Font, PatternFill  # noqa: E402
+from excel_engine import copy_cell_style, new_style_cache  # noqa: E402
+from previous_paths import copy_column_widths  # noqa: E402
+from xlsx_package import split_sheet_packages  # noqa: E402
+
+HEADERS = ["Tracking Number", "MR", "Line", "CRM Interval Date", "Cost", "Professionl Accounts"]
+
+
+def make_workbook(sheets, rows):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Region {s}")
+        ws.append(HEADERS)
+        for cell in ws[1]:
+            cell.font = Font(bold=True)
+        for i in range(rows):
+            ws.append([s * 10**6 + i, f"MR {i % 40}", "Line", "2024-01", i * 1.5, f"Dr Name {i % 500}"])
+        ws.freeze_panes = "A2"
+        ws.conditional_formatting.add(
+            f"E2:E{rows + 1}", CellIsRule(operator="greaterThan", formula=["100"],
+                                          fill=PatternFill("solid", fgColor="FFFFFF00")))
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def cell_copy(data):
+    original_wb = load_workbook(BytesIO(data), data_only=False)
+    for sheet_name in original_wb.sheetnames:
+        new_wb = Workbook()
+        new_wb.remove(new_wb.active)
+        new_ws = new_wb.create_sheet(title=sheet_name)
+        src_ws = original_wb[sheet_name]
+        style_cache = new_style_cache()
+        for row in src_ws.iter_rows():
+            for src_cell in row:
+                dst = new_ws.cell(src_cell.row, src_cell.column, src_cell.value)
+                copy_cell_style(src_cell, dst, style_cache)
+        for merged_range in src_ws.merged_cells.ranges:
+            new_ws.merge_cells(str(merged_range))
+        copy_column_widths(src_ws, new_ws)
+        new_wb.save(BytesIO())
+
+
+def package_split(data):
+    for _name, _xlsx in split_sheet_packages(data):
+        pass
+
+
+def main():
+    sheets = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    data = make_workbook(sheets, rows)
+    print(f"{sheets} sheets x {rows:,} rows, {len(data) / 1e6:.1f} MB\n")
+    for label, func in (("cell copy", cell_copy), ("split_sheet_packages", package_split)):
+        start = time.perf_counter()
+        func(data)
+        print(f"{label:<25} {time.perf_counter() - start:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: ZIP writing for a 1,000-group split.
+- CSV members: zipfile's own serial deflate vs. thread-parallel deflate
+- CSV split end to end: whole-frame groups (the previous path, kept below)
+  vs. the chunked streaming split
+- xlsx members: re-deflating already-compressed workbooks vs. ZIP_STORED
+
+Run from the repo root:  python benchmarks/bench_split_zip.py
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csv_ingest import iter_csv_chunks  # noqa: E402
+from excel_engine import (  # noqa: E402
+    CSV_CHUNK_ROWS, CSV_ZIP_LEVEL, _deflate, default_workers, group_positions, match_keys,
+    split_csv_stream, write_raw_member,
+)
+
+GROUPS = 1000
+ROWS = 300_000
+
+
+def _timed(label, func):
+    start = time.perf_counter()
+    size = func()
+    print(f"{label:<45} {time.perf_counter() - start:7.2f} s  {size / 1e6:8.1f} MB")
+
+
+def write_deflated_members(zip_file, members, level=CSV_ZIP_LEVEL, threads=None):
+    """The previous whole-frame path: deflate (name, bytes) members in a thread pool, write in order."""
+    threads = threads or default_workers()
+    pending = deque()
+
+    def write(name, deflated):
+        compressed, crc, size = deflated
+        write_raw_member(zip_file, name, ZIP_DEFLATED, crc, size, len(compressed), (compressed,))
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for name, data in members:
+            pending.append((name, pool.submit(_deflate, data, level)))
+            if len(pending) >= 2 * threads:
+                done_name, future = pending.popleft()
+                write(done_name, future.result())
+        while pending:
+            done_name, future = pending.popleft()
+            write(done_name, future.result())
+
+
+def write_frame_groups(zip_file, df, keys, labels, name_func, level=CSV_ZIP_LEVEL, threads=None):
+    """The previous CSV split: one `<name>.csv` member per group of the in-memory frame."""
+    groups = group_positions(keys)
+
+    def members():
+        for positions in groups.values():
+            name = name_func(labels.iloc[positions[0]])
+            yield f"{name}.csv", df.iloc[positions].to_csv(index=False).encode("utf-8-sig")
+
+    write_deflated_members(zip_file, members(), level, threads)
+    return len(groups)
+
+
+def _csv_members(df, keys):
+    for key, positions in group_positions(keys).items():
+        yield f"{key}.csv", df.iloc[positions].to_csv(index=False).encode("utf-8-sig")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "MR": [f"MR {i:04d}" for i in rng.integers(0, GROUPS, ROWS)],
+        "Tracking Number": rng.integers(10**6, 10**7, ROWS),
+        "Cost": rng.random(ROWS) * 1000,
+        "Description": rng.choice(["Visit", "Conference", "Sample", "Dinner meeting"], ROWS),
+    })
+    keys = match_keys(df["MR"])
+    members = list(_csv_members(df, keys))
+    print(f"{GROUPS} groups, {ROWS:,} rows, {default_workers()} CPU(s)\n")
+
+    def zipfile_deflate():
+        buf = BytesIO()
+        with ZipFile(buf, "w", ZIP_DEFLATED, compresslevel=CSV_ZIP_LEVEL) as zf:
+            for name, data in members:
+                zf.writestr(name, data)
+        return buf.tell()
+
+    def threaded_deflate(threads):
+        def run():
+            buf = BytesIO()
+            with ZipFile(buf, "w") as zf:
+                write_deflated_members(zf, iter(members), CSV_ZIP_LEVEL, threads)
+            return buf.tell()
+        return run
+
+    def end_to_end():
+        buf = BytesIO()
+        with ZipFile(buf, "w") as zf:
+            write_frame_groups(zf, df, keys, df["MR"], str)
+        return buf.tell()
+
+    source = df.to_csv(index=False).encode("utf-8")
+
+    def streaming_split():
+        buf = BytesIO()
+        with ZipFile(buf, "w") as zf:
+            split_csv_stream(zf, iter_csv_chunks(source, CSV_CHUNK_ROWS, dtype=str), "MR", str)
+        return buf.tell()
+
+    print("CSV members (compression only)")
+    _timed("  zipfile ZIP_DEFLATED, serial", zipfile_deflate)
+    for threads in sorted({1, 4, default_workers()}):
+        _timed(f"  write_deflated_members, {threads} thread(s)", threaded_deflate(threads))
+    _timed("  write_frame_groups end-to-end (to_csv + zip)", end_to_end)
+    _timed("  split_csv_stream end-to-end (+ read_csv)", streaming_split)
+
+    # xlsx members are ZIP containers already; model them with a deflated blob
+    blob = BytesIO()
+    with ZipFile(blob, "w", ZIP_DEFLATED) as zf:
+        zf.writestr("xl/worksheets/sheet1.xml", os.urandom(64) * 2000)
+    blob = blob.getvalue()
+
+    def xlsx_zip(compression):
+        def run():
+            buf = BytesIO()
+            with ZipFile(buf, "w", compression) as zf:
+                for i in range(GROUPS):
+                    zf.writestr(f"{i}.xlsx", blob)
+            return buf.tell()
+        return run
+
+    print("\nxlsx members")
+    _timed("  ZIP_DEFLATED (re-compress)", xlsx_zip(ZIP_DEFLATED))
+    _timed("  ZIP_STORED", xlsx_zip(ZIP_STORED))
+
+
+if __name__ == "__main__":
+    main()
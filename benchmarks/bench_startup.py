@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: cold start (first script run of a new session) against a budget.
+Runs app.py headless with Streamlit's AppTest in a fresh interpreter and
+fails (exit 1) when the first run exceeds STARTUP_BUDGET_S.
+
+Run from the repo root:  python benchmarks/bench_startup.py
+Set TFE_OFFLINE=1 to model an air-gapped server.
+"""
+
+import os
+import subprocess
+import sys
+
+STARTUP_BUDGET_S = float(os.environ.get("TFE_STARTUP_BUDGET", "3.0"))
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=60)
+at.run()
+t2 = time.perf_counter()
+at.run()
+t3 = time.perf_counter()
+assert not at.exception, at.exception
+print(f"{t1 - t0:.3f} {t2 - t1:.3f} {t3 - t2:.3f}")
+"""
+
+
+def main():
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout.split()
+    import_s, first_s, rerun_s = map(float, out[-3:])
+    print(f"streamlit import     {import_s:6.2f} s")
+    print(f"first run (cold)     {first_s:6.2f} s   budget {STARTUP_BUDGET_S:.2f} s")
+    print(f"rerun (warm)         {rerun_s:6.2f} s")
+    if first_s > STARTUP_BUDGET_S:
+        print("❌ cold start over budget")
+        sys.exit(1)
+    print("✅ cold start within budget")
+
+
+if __name__ == "__main__":
+    main()
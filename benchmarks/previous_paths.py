@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+The Split / Merge card code paths the app no longer uses, kept as the
+baselines the benchmarks time the current engine against.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl.cell import WriteOnlyCell  # noqa: E402
+from excel_engine import copy_cell_style  # noqa: E402
+
+
+def copy_column_widths(src_ws, dst_ws):
+    """The previous Split / Merge width copy."""
+    for col_letter, dim in src_ws.column_dimensions.items():
+        if dim.width:
+            dst_ws.column_dimensions[col_letter].width = dim.width
+
+
+def append_styled_row(ws, src_row, style_cache=None, skip_empty=False):
+    """The previous Merge row copy."""
+    out = []
+    for src in src_row:
+        if src.value is None and (skip_empty or not src.has_style):
+            out.append(None)
+            continue
+        dst = WriteOnlyCell(ws, value=src.value)
+        copy_cell_style(src, dst, style_cache)
+        out.append(dst)
+    ws.append(out)
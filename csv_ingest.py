@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+CSV reading shared by Split and Merge (no UI code here).
+- Encoding: BOM (UTF-8 / UTF-16), else UTF-8 when every byte decodes as
+  UTF-8, else Windows-1256 (Arabic Excel exports); delimiter sniffed from
+  the first block
+- All reads use pandas' C parser: pyarrow's reader can only skip or reject
+  the short rows pandas pads, and types dates/blank cells differently, so
+  Split and Merge would write different values depending on the engine
+- Every read fills a `stats` dict: engine, encoding, delimiter, rows, seconds
+"""
+
+import codecs
+import csv
+from io import BytesIO
+import time
+
+import pandas as pd
+
+SNIFF_BYTES = 64 * 1024
+UTF8_CHECK_BYTES = 1024 * 1024  # block size for the whole-file UTF-8 check
+SNIFF_DIALECT_CHARS = 8 * 1024  # csv.Sniffer is quadratic on quoted fields; a few KB is plenty
+DELIMITERS = ",;\t|"
+FALLBACK_ENCODING = "cp1256"  # every byte decodes, so this never fails
+
+
+def _is_utf8(data):
+    """True when all of `data` decodes as UTF-8 (checked block by block, nothing kept)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    view = memoryview(data)
+    try:
+        for pos in range(0, len(view), UTF8_CHECK_BYTES):
+            decoder.decode(view[pos:pos + UTF8_CHECK_BYTES])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def sniff_csv(data):
+    """(encoding, delimiter) for a CSV (bytes)."""
+    head = data[:SNIFF_BYTES]
+    if head.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    elif head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    else:
+        # The whole file: an ASCII head says nothing about the Arabic further down
+        encoding = "utf-8" if _is_utf8(data) else FALLBACK_ENCODING
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(head, final=False)
+    text = text[:SNIFF_DIALECT_CHARS]
+    sample = text[:text.rfind("\n") + 1] or text
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ","
+    return encoding, delimiter
+
+def read_csv_frame(data, nrows=None, stats=None, **kwargs):
+    """
+    DataFrame of a whole CSV (bytes) with sniffed encoding and delimiter.
+    Extra keyword arguments go to `pd.read_csv`.
+    """
+    start = time.perf_counter()
+    encoding, delimiter = sniff_csv(data)
+    df = pd.read_csv(BytesIO(data), sep=delimiter, encoding=encoding, nrows=nrows, **kwargs)
+    if stats is not None:
+        stats.update(engine="c", encoding=encoding, delimiter=delimiter,
+                     rows=len(df), seconds=time.perf_counter() - start)
+    return df
+
+def csv_columns(data):
+    """Column labels of a CSV, as `pd.read_csv` names them, from its header row only."""
+    encoding, delimiter = sniff_csv(data)
+    return list(pd.read_csv(BytesIO(data), sep=delimiter, encoding=encoding, nrows=0).columns)
+
+def iter_csv_chunks(data, chunksize, stats=None, **kwargs):
+    """Yield DataFrames of `chunksize` rows; `stats` is complete once the iteration ends."""
+    start = time.perf_counter()
+    encoding, delimiter = sniff_csv(data)
+    rows = 0
+    try:
+        for chunk in pd.read_csv(BytesIO(data), sep=delimiter, encoding=encoding,
+                                 chunksize=chunksize, **kwargs):
+            rows += len(chunk)
+            yield chunk
+    finally:
+        if stats is not None:
+            stats.update(engine="c", encoding=encoding, delimiter=delimiter,
+                         rows=rows, seconds=time.perf_counter() - start)
@@ -0,0 +1,1039 @@
+# -*- coding: utf-8 -*-
+"""
+Workbook engine used by the Streamlit app (no UI code here).
+- Style / width copy helpers shared by Split, Merge and the Processor
+- Write-only (streaming) output sheets for large outputs
+- Compact row payloads + process-pool fan-out for CPU-bound output
+- Disk-backed output files (ZIPs / workbooks) instead of nested BytesIO copies
+- ZIP members: stored for xlsx (already deflated), thread-parallel deflate for CSV
+- Split engine: vectorized match keys + per-group workbook/CSV output
+- Merge engine: inputs parsed in worker processes, appended in upload order
+  or k-way merged from sorted runs on disk; CSV / mixed inputs streamed in
+  chunks onto the union of their columns
+"""
+
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from copy import copy
+from functools import lru_cache
+from datetime import date, datetime
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+import hashlib
+import heapq
+import multiprocessing
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import weakref
+import zipfile
+import zlib
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter, column_index_from_string
+from pandas.io.parsers import TextParser
+
+
+# ------------------ Style helpers ------------------
+def new_style_cache():
+    """
+    Style cache for `copy_cell_style`, one per output workbook.
+    Maps source workbook -> {source style array: destination style array};
+    entries go away with their source workbook.
+    """
+    return weakref.WeakKeyDictionary()
+
+def _style_key(cell):
+    style = getattr(cell, "_style", None)
+    if style is not None:
+        return tuple(style)
+    return cell._style_id  # read-only cells only carry an index
+
+def copy_cell_style(src_cell, dst_cell, cache=None):
+    """نسخ كل التنسيقات من خلية لأخرى"""
+    if cache is not None and src_cell.has_style:
+        # Build each distinct source style once, then reuse its style array
+        styles = cache.get(src_cell.parent.parent)
+        if styles is None:
+            styles = cache[src_cell.parent.parent] = {}
+        key = _style_key(src_cell)
+        cached = styles.get(key)
+        if cached is None:
+            copy_cell_style(src_cell, dst_cell)
+            styles[key] = copy(dst_cell._style) if dst_cell._style is not None else None
+        else:
+            dst_cell._style = copy(cached)
+        return
+    if src_cell.has_style:
+        try:
+            if src_cell.font:
+                dst_cell.font = Font(
+                    name=src_cell.font.name,
+                    size=src_cell.font.size,
+                    bold=src_cell.font.bold,
+                    italic=src_cell.font.italic,
+                    vertAlign=src_cell.font.vertAlign,
+                    underline=src_cell.font.underline,
+                    strike=src_cell.font.strike,
+                    color=src_cell.font.color
+                )
+            if src_cell.fill and src_cell.fill.fill_type:
+                dst_cell.fill = PatternFill(
+                    fill_type=src_cell.fill.fill_type,
+                    start_color=src_cell.fill.start_color,
+                    end_color=src_cell.fill.end_color
+                )
+            if src_cell.alignment:
+                dst_cell.alignment = Alignment(
+                    horizontal=src_cell.alignment.horizontal,
+                    vertical=src_cell.alignment.vertical,
+                    text_rotation=src_cell.alignment.text_rotation,
+                    wrap_text=src_cell.alignment.wrap_text,
+                    shrink_to_fit=src_cell.alignment.shrink_to_fit,
+                    indent=src_cell.alignment.indent
+                )
+            if src_cell.border:
+                dst_cell.border = Border(
+                    left=src_cell.border.left,
+                    right=src_cell.border.right,
+                    top=src_cell.border.top,
+                    bottom=src_cell.border.bottom,
+                    diagonal=src_cell.border.diagonal,
+                    diagonal_direction=src_cell.border.diagonal_direction,
+                    outline=src_cell.border.outline,
+                    vertical=src_cell.border.vertical,
+                    horizontal=src_cell.border.horizontal
+                )
+            dst_cell.number_format = src_cell.number_format
+        except Exception:
+            pass
+
+
+# ------------------ Output sheets ------------------
+def new_output_workbook(title):
+    """
+    Single-sheet write-only output workbook. Write-only sheets stream rows
+    to disk on save and keep memory flat, but they cannot merge cells and
+    column widths must be set before the first row is appended.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=title)
+    return wb, ws
+
+def read_only_column_widths(ws):
+    """
+    {column letter: width} for a read-only sheet, which does not load
+    <cols>: scans the sheet XML up to the first row.
+    """
+    widths = {}
+    with ws._get_source() as src:
+        for _event, el in iterparse(src, events=("start",)):
+            tag = el.tag.rsplit("}", 1)[-1]
+            if tag == "sheetData":
+                break
+            if tag == "col" and el.get("width"):
+                width = float(el.get("width"))
+                for idx in range(int(el.get("min")), int(el.get("max", el.get("min"))) + 1):
+                    widths[get_column_letter(idx)] = width
+    return widths
+
+
+# ------------------ Disk-backed outputs ------------------
+def open_temp_output(suffix):
+    """Writable binary temp file on disk for an output (ZIP / xlsx); prefer `temp_output`."""
+    return tempfile.NamedTemporaryFile(prefix="tfe_", suffix=suffix, delete=False)
+
+@contextmanager
+def temp_output(suffix):
+    """
+    `open_temp_output` as a context manager: if the block raises, the file
+    is closed and deleted. Otherwise it stays open for `finish_temp_output`.
+    """
+    fh = open_temp_output(suffix)
+    try:
+        yield fh
+    except BaseException:
+        fh.close()
+        try:
+            os.unlink(fh.name)
+        except OSError:
+            pass
+        raise
+
+def finish_temp_output(fh):
+    """
+    Close a file from `temp_output` and return a no-argument callable that
+    reads it whole, for st.download_button's deferred `data`: the output
+    stays on disk until the user clicks download, when Streamlit reads it
+    into memory to serve it. The path is unlinked right away; the open
+    handle is closed once the callable is garbage-collected (Streamlit
+    drops it when the button goes away).
+    """
+    fh.close()
+    reader = open(fh.name, "rb")
+    try:
+        os.unlink(fh.name)
+    except OSError:
+        pass
+    lock = threading.Lock()
+
+    def read_output():
+        with lock:
+            reader.seek(0)
+            return reader.read()
+    weakref.finalize(read_output, reader.close)
+    return read_output
+
+def save_workbook_to_temp(wb):
+    """Save `wb` straight to a temp file; returns a reader callable (see `finish_temp_output`)."""
+    with temp_output(".xlsx") as fh:
+        wb.save(fh)
+    return finish_temp_output(fh)
+
+
+# ------------------ ZIP members ------------------
+CSV_ZIP_LEVEL = 6
+
+def _deflate(data, level):
+    """Raw deflate stream + CRC of `data` (zlib releases the GIL while compressing)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+# Raw members: compressed payloads copied as-is between archives. Writing
+# and reading them uses ZipFile internals (_lock, _writecheck, _didModify,
+# start_dir, the shared fp); `raw_members_supported` checks both at runtime
+# and the public ZipFile.open path takes over if they changed. Checked on
+# CPython 3.9, 3.10, 3.11, 3.12 and 3.13.
+def _append_raw_member(zip_file, zinfo, blocks):
+    # Same bookkeeping as ZipFile.mkdir
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    with zip_file._lock:
+        if zip_file._seekable:
+            zip_file.fp.seek(zip_file.start_dir)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        zip_file.fp.write(zinfo.FileHeader(zip64))
+        for block in blocks:
+            zip_file.fp.write(block)
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
+        zip_file.start_dir = zip_file.fp.tell()
+
+def _read_raw_member(zip_file, info):
+    # The stored bytes past the member's local header, under the archive's lock
+    with zip_file._lock:
+        zip_file.fp.seek(info.header_offset)
+        name_len, extra_len = struct.unpack("<HH", zip_file.fp.read(30)[26:30])
+        zip_file.fp.seek(info.header_offset + 30 + name_len + extra_len)
+        return zip_file.fp.read(info.compress_size)
+
+def _reencode_member(zip_file, zinfo, blocks):
+    """Fallback through the public API: inflate `blocks` and let ZipFile compress them again."""
+    decompressor = zlib.decompressobj(-15) if zinfo.compress_type == zipfile.ZIP_DEFLATED else None
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT
+    with zip_file.open(zinfo, "w", force_zip64=zip64) as dst:
+        for block in blocks:
+            dst.write(decompressor.decompress(block) if decompressor else block)
+        if decompressor:
+            dst.write(decompressor.flush())
+
+@lru_cache(maxsize=None)
+def raw_members_supported():
+    """
+    Round trip of a raw member next to a regular one, in a seekable and an
+    unseekable archive (testzip + read back), then a raw read and copy of
+    it into a second archive. False when a Python upgrade changed the
+    ZipFile internals `_append_raw_member` / `_read_raw_member` rely on.
+    """
+    data = b"Tracking Number,MR,Cost\r\n" * 64
+    compressed, crc, size = _deflate(data, CSV_ZIP_LEVEL)
+
+    class Unseekable(BytesIO):
+        def seekable(self):
+            return False
+
+        def seek(self, *args):
+            raise OSError("unseekable")
+
+        def tell(self):
+            raise OSError("unseekable")
+
+    try:
+        for buf in (BytesIO(), Unseekable()):
+            with zipfile.ZipFile(buf, "w") as zf:
+                zinfo = _member_info("raw.csv", zipfile.ZIP_DEFLATED, crc, size, len(compressed))
+                _append_raw_member(zf, zinfo, (compressed,))
+                zf.writestr("after.csv", data)
+            with zipfile.ZipFile(BytesIO(buf.getvalue())) as zf:
+                if zf.testzip() is not None or zf.read("raw.csv") != data or zf.read("after.csv") != data:
+                    return False
+                if _read_raw_member(zf, zf.getinfo("raw.csv")) != compressed:
+                    return False
+                copied = BytesIO()
+                with zipfile.ZipFile(copied, "w") as dst:
+                    info = zf.getinfo("after.csv")
+                    zinfo = _member_info(info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size)
+                    _append_raw_member(dst, zinfo, (_read_raw_member(zf, info),))
+            with zipfile.ZipFile(copied) as zf:
+                if zf.testzip() is not None or zf.read("after.csv") != data:
+                    return False
+    except Exception:
+        return False
+    return True
+
+def _member_info(name, compress_type, crc, size, compress_size):
+    zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = 0o600 << 16
+    zinfo.file_size = size
+    zinfo.compress_size = compress_size
+    zinfo.CRC = crc
+    return zinfo
+
+def write_raw_member(zip_file, name, compress_type, crc, size, compress_size, blocks):
+    """
+    Append a member whose payload (already compressed as `compress_type`)
+    is the `blocks` bytes, copied as-is. If `raw_members_supported()` fails
+    on this Python, the payload is re-compressed through ZipFile.open instead.
+    """
+    zinfo = _member_info(name, compress_type, crc, size, compress_size)
+    if raw_members_supported():
+        _append_raw_member(zip_file, zinfo, blocks)
+    else:
+        _reencode_member(zip_file, zinfo, blocks)
+
+def copy_zip_member(src, info, dst):
+    """
+    Copy member `info` of the ZipFile `src` into `dst` without inflating
+    and re-compressing it; through ZipFile.open (decompress + compress)
+    when `raw_members_supported()` fails on this Python.
+    """
+    if raw_members_supported():
+        write_raw_member(dst, info.filename, info.compress_type, info.CRC,
+                         info.file_size, info.compress_size, (_read_raw_member(src, info),))
+        return
+    zinfo = _member_info(info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size)
+    with src.open(info) as fsrc, dst.open(zinfo, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+
+# ===================== Robust Value Comparison =====================
+def match_keys(series):
+    """
+    Vectorized grouping key with the semantics of the Split card's original
+    cell-by-cell comparison: numbers compare by float value ("n:1.0"), text
+    by stripped lower-case string ("s:abc"). Empty cells get <NA>.
+    benchmarks/bench_match_keys.py checks the two group alike.
+    """
+    values = series.astype(float) if pd.api.types.is_bool_dtype(series) else series
+    text = values.astype(str).str.strip()
+    if (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_object_dtype(values)
+            or pd.api.types.is_string_dtype(values)):
+        num = pd.to_numeric(values, errors="coerce")
+        num = num.where(num.notna(), pd.to_numeric(text, errors="coerce"))
+    else:
+        num = pd.Series(float("nan"), index=values.index)
+    keys = ("s:" + text.str.lower()).astype(object)
+    is_num = num.notna()
+    keys[is_num] = "n:" + (num[is_num].astype(float) + 0.0).astype(str)  # -0.0 -> 0.0
+    keys[series.isna()] = pd.NA
+    return keys.reset_index(drop=True)
+
+def group_positions(keys):
+    """{key: [row positions]} in order of first appearance, empty keys dropped."""
+    valid = keys.dropna()
+    groups = valid.groupby(valid, sort=False).groups
+    return {k: list(groups[k]) for k in pd.unique(valid)}
+# ===================================================================
+
+
+# ===================== Row Payloads & Parallel Output =====================
+# Worker processes get plain values + style ids, never openpyxl objects.
+def _style_spec(cell):
+    return (copy(cell.font), copy(cell.fill), copy(cell.border),
+            copy(cell.alignment), copy(cell.protection), cell.number_format)
+
+def row_payload(row, style_ids, styles, skip_empty=False):
+    """
+    (values, style ids) for a row of source cells. New styles are appended
+    to `styles` (index 0 = unstyled) and indexed in `style_ids`.
+    `skip_empty` leaves empty cells unstyled (merge input rows).
+    """
+    values = tuple(c.value for c in row)
+    ids = []
+    for c in row:
+        if not getattr(c, "has_style", False) or (skip_empty and c.value is None):
+            ids.append(0)
+            continue
+        key = _style_key(c)
+        sid = style_ids.get(key)
+        if sid is None:
+            sid = style_ids[key] = len(styles)
+            styles.append(_style_spec(c))
+        ids.append(sid)
+    return values, tuple(ids)
+
+def row_hash(values):
+    """Content hash of a row's values (trailing empty cells ignored)."""
+    values = list(values)
+    while values and values[-1] is None:
+        values.pop()
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).hexdigest()
+
+def render_payload_workbook(title, widths, rows, styles):
+    """Build a write-only single-sheet workbook from payload rows; returns xlsx bytes."""
+    wb, ws = new_output_workbook(title)
+    for letter, width in widths.items():
+        ws.column_dimensions[letter].width = width
+    append_payload_rows(ws, rows, styles)
+    fb = BytesIO()
+    wb.save(fb)
+    return fb.getvalue()
+
+def append_payload_rows(ws, rows, styles, arrays=None):
+    """
+    Append payload rows to a write-only sheet; returns how many. `arrays`
+    caches the built style array per style id; pass the same dict for
+    every call on `ws`.
+    """
+    if arrays is None:
+        arrays = {}
+    count = 0
+    for values, ids in rows:
+        out = []
+        for value, sid in zip(values, ids):
+            if not sid:
+                out.append(value)
+                continue
+            dst = WriteOnlyCell(ws, value=value)
+            arr = arrays.get(sid)
+            if arr is None:
+                font, fill, border, alignment, protection, number_format = styles[sid]
+                dst.font = font
+                dst.fill = fill
+                dst.border = border
+                dst.alignment = alignment
+                dst.protection = protection
+                dst.number_format = number_format
+                arrays[sid] = copy(dst._style)
+            else:
+                dst._style = copy(arr)
+            out.append(dst)
+        ws.append(out)
+        count += 1
+    return count
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def pool_context():
+    """
+    Start method for worker pools: never fork. The Streamlit server runs
+    threads (sessions, the mapping refreshers) that may hold locks during
+    HTTP or SQLite calls, and a forked child would inherit them locked.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # The single-threaded server imports pandas/openpyxl once; workers fork from it
+    context.set_forkserver_preload(["excel_engine"])
+    return context
+
+def run_parallel(func, tasks, workers=None):
+    """
+    Yield func(*task) for every task, in task order. Uses a process pool
+    when workers > 1 and falls back to running serially in this process
+    if the pool cannot be started or breaks (workers are started with
+    `pool_context`, so `func` and the tasks must pickle). At most `workers` tasks are
+    submitted ahead of the one being yielded, so finished results waiting
+    behind a slow task stay bounded.
+    """
+    tasks = list(tasks)
+    workers = min(workers or default_workers(), len(tasks))
+    done = 0
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                pending = deque()
+                for task in tasks:
+                    if len(pending) == workers:
+                        result = pending.popleft().result()
+                        done += 1
+                        yield result
+                    pending.append(pool.submit(func, *task))
+                while pending:
+                    result = pending.popleft().result()
+                    done += 1
+                    yield result
+            return
+        except (OSError, BrokenProcessPool, pickle.PicklingError):
+            pass
+    for task in tasks[done:]:
+        yield func(*task)
+
+
+# ===================== Split Engine =====================
+def read_excel_values(values):
+    """Cell values of one column as `pd.read_excel` converts them ("N/A", "" -> NaN, 7.0 -> 7)."""
+    with TextParser([[v] for v in values], header=None, skip_blank_lines=False) as parser:
+        frame = parser.read()
+    return frame[0] if len(frame.columns) else pd.Series([None] * len(values), dtype=object)
+
+def split_sheet_by_column(data, sheet_name, column, name_func, on_progress=None, workers=None):
+    """
+    Split a sheet of an xlsx (bytes) into one workbook per distinct value
+    of its `column`-th column (0-based; values grouped by `match_keys`,
+    empty cells dropped). One read-only pass collects the row payloads
+    and the column's values; each group is named after its first value.
+    Workbooks are generated across `workers` processes (1 = serial).
+    Yields (name, xlsx_bytes) in group order.
+    """
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=False)
+    try:
+        ws = wb[sheet_name]
+        style_ids, styles = {}, [None]
+        rows = ws.iter_rows(min_row=1)
+        header = row_payload(next(rows, ()), style_ids, styles)
+        payloads, values = [], []
+        for row in rows:
+            payloads.append(row_payload(row, style_ids, styles))
+            values.append(row[column].value if column < len(row) else None)
+        widths = read_only_column_widths(ws)
+    finally:
+        wb.close()
+
+    labels = read_excel_values(values)
+    groups = group_positions(match_keys(labels))
+    names = [name_func(labels.iloc[positions[0]]) for positions in groups.values()]
+    tasks = (
+        (name, widths, [header] + [payloads[p] for p in positions], styles)
+        for name, positions in zip(names, groups.values())
+    )
+    total = len(names)
+    results = run_parallel(render_payload_workbook, tasks, workers)
+    for i, (name, data) in enumerate(zip(names, results)):
+        if on_progress:
+            on_progress(i + 1, total, name)
+        yield name, data
+
+# ------------------ Streaming CSV split ------------------
+# Each chunk's rows for a group are deflated on their own and end with a
+# sync flush, so the pieces of one group concatenate into a single valid
+# deflate stream (closed by an empty final block). The pieces wait in one
+# spill file; only a chunk of the CSV is ever in memory.
+CSV_CHUNK_ROWS = 100_000
+_FINAL_BLOCK = zlib.compressobj(CSV_ZIP_LEVEL, zlib.DEFLATED, -15).flush()
+
+def _deflate_piece(data, level):
+    if level == 0:
+        return data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def _spilled_blocks(spill, pieces, tail):
+    for offset, length in pieces:
+        spill.seek(offset)
+        yield spill.read(length)
+    yield tail
+
+def split_csv_stream(zip_file, chunks, column, name_func, level=CSV_ZIP_LEVEL,
+                     threads=None, on_progress=None):
+    """
+    One-pass, bounded-memory CSV split by `column` (see `match_keys`):
+    `chunks` are DataFrames of consecutive rows (read with dtype=str so
+    values are written back as they came, e.g. `csv_ingest.iter_csv_chunks`);
+    each chunk is routed to its groups with one groupby on `match_keys`,
+    and every group's rows are deflated at `level` in `threads` threads and
+    appended to a spill file. The `<name>.csv` members (named after the
+    first label of each group, in order of first appearance) are assembled
+    from the spill at the end. `on_progress(rows read)` runs per chunk.
+    Returns the group count.
+    """
+    compress_type = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+    groups = {}  # key -> [name, [(offset, length)], crc, size]
+    rows_read = 0
+    with tempfile.TemporaryFile(prefix="tfe_") as spill, \
+            ThreadPoolExecutor(max_workers=threads or default_workers()) as pool:
+        for chunk in chunks:
+            keys = match_keys(chunk[column])
+            labels = chunk[column].reset_index(drop=True)
+            pieces = []
+            for key, positions in group_positions(keys).items():
+                group = groups.get(key)
+                first = group is None
+                if first:
+                    group = groups[key] = [name_func(labels.iloc[positions[0]]), [], 0, 0]
+                text = chunk.iloc[positions].to_csv(index=False, header=first)
+                data = ("\ufeff" + text if first else text).encode("utf-8")
+                group[2] = zlib.crc32(data, group[2])
+                group[3] += len(data)
+                pieces.append((group, pool.submit(_deflate_piece, data, level)))
+            for group, future in pieces:
+                piece = future.result()
+                group[1].append((spill.tell(), len(piece)))
+                spill.write(piece)
+            rows_read += len(chunk)
+            if on_progress:
+                on_progress(rows_read)
+        tail = _FINAL_BLOCK if level else b""
+        for name, pieces, crc, size in groups.values():
+            compress_size = sum(length for _offset, length in pieces) + len(tail)
+            write_raw_member(zip_file, f"{name}.csv", compress_type, crc, size, compress_size,
+                              _spilled_blocks(spill, pieces, tail))
+    return len(groups)
+
+
+# ===================== Merge Engine =====================
+def header_keys(headers):
+    """
+    Alignment key per header cell: stripped, case-folded text plus its
+    occurrence, so repeated or blank headers pair up in order.
+    """
+    seen = Counter()
+    keys = []
+    for header in headers:
+        text = "" if header is None else str(header).strip().casefold()
+        seen[text] += 1
+        keys.append((text, seen[text]))
+    return keys
+
+def value_key(value):
+    """Scalar `match_keys` (de-duplication key of one cell); None when empty."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return f"n:{float(value if isinstance(value, (int, float)) else text)}"
+    except (ValueError, TypeError):
+        return f"s:{text.lower()}"
+
+def sheet_header(data):
+    """Worker task: (column widths, header row payload, styles) of the active sheet of one xlsx."""
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=False)
+    try:
+        ws = wb.active
+        style_ids, styles = {}, [None]
+        header = row_payload(next(ws.iter_rows(max_row=1), ()), style_ids, styles, skip_empty=True)
+        widths = read_only_column_widths(ws)
+    finally:
+        wb.close()
+    return widths, header, styles
+
+def _aligned(payload, positions, width):
+    values, ids = [None] * width, [0] * width
+    for value, sid, dst in zip(*payload, positions):
+        values[dst] = value
+        ids[dst] = sid
+    return tuple(values), tuple(ids)
+
+def merge_payload(data, first, positions=None):
+    """
+    Worker task: parse the active sheet of one xlsx (bytes) with a read-only
+    load into (column widths, payload rows, styles). Only the `first` input
+    keeps its header row and column widths; empty cells stay unstyled.
+    `positions` (output column per source column) reorders every row into
+    the header-aligned layout here in the worker.
+    """
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=False)
+    try:
+        ws = wb.active
+        widths = read_only_column_widths(ws) if first else {}
+        style_ids, styles = {}, [None]
+        rows = [
+            row_payload(row, style_ids, styles, skip_empty=True)
+            for row in ws.iter_rows(min_row=1 if first else 2)
+        ]
+    finally:
+        wb.close()
+    if positions is not None:
+        width = max(positions, default=-1) + 1
+        rows = [_aligned(row, positions, width) for row in rows]
+    return widths, rows, styles
+
+# Sorted merge: each input becomes sorted runs of at most SORT_RUN_ROWS rows,
+# pickled to temp files in SPILL_BATCH slices; the runs are then k-way merged
+# with a heap, so memory holds one slice per run instead of every row.
+SORT_RUN_ROWS = 50_000
+SPILL_BATCH = 1000
+
+def sort_key(value):
+    """Order used by the sorted merge: numbers (and numeric text), then dates, then text; empty cells last."""
+    if isinstance(value, bool):
+        return (0, float(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, datetime):
+        return (1, value.replace(tzinfo=None))
+    if isinstance(value, date):
+        return (1, datetime.combine(value, datetime.min.time()))
+    text = "" if value is None else str(value).strip()
+    if not text:
+        return (3,)
+    try:
+        number = float(text)
+    except ValueError:
+        return (2, text.casefold())
+    return (0, number) if number == number else (2, text.casefold())
+
+def _row_sort_key(sort_col):
+    return lambda row: sort_key(row[0][sort_col] if sort_col < len(row[0]) else None)
+
+def _spill_run(rows, sort_col):
+    rows.sort(key=_row_sort_key(sort_col))
+    with temp_output(".run") as fh, fh:
+        for i in range(0, len(rows), SPILL_BATCH):
+            pickle.dump(rows[i:i + SPILL_BATCH], fh, pickle.HIGHEST_PROTOCOL)
+    return fh.name
+
+def _read_run(path, remap):
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                batch = pickle.load(fh)
+            except EOFError:
+                return
+            for values, ids in batch:
+                yield values, tuple(remap[sid] for sid in ids)
+
+def sorted_runs(data, positions, sort_col, run_rows=SORT_RUN_ROWS):
+    """
+    Worker task: the data rows of one xlsx (bytes) as payload rows sorted on
+    output column `sort_col`, in runs of at most `run_rows` rows spilled to
+    temp files. `positions` as in `merge_payload`. Returns (styles, run paths);
+    the caller deletes the files.
+    """
+    paths = []
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=False)
+    try:
+        ws = wb.active
+        style_ids, styles = {}, [None]
+        width = max(positions, default=-1) + 1 if positions is not None else None
+        run = []
+        for row in ws.iter_rows(min_row=2):
+            payload = row_payload(row, style_ids, styles, skip_empty=True)
+            run.append(payload if positions is None else _aligned(payload, positions, width))
+            if len(run) == run_rows:
+                paths.append(_spill_run(run, sort_col))
+                run = []
+        if run:
+            paths.append(_spill_run(run, sort_col))
+    except BaseException:
+        for path in paths:
+            os.unlink(path)
+        raise
+    finally:
+        wb.close()
+    return styles, paths
+
+def _column_index(headers, name):
+    keys = header_keys(headers)
+    target = (str(name).strip().casefold(), 1)
+    if target not in keys:
+        raise ValueError(f"No column named '{name}'")
+    return keys.index(target)
+
+def merge_workbooks(ws, sources, on_progress=None, workers=None,
+                    align_headers=False, dedupe=False, key_column=None, sort_column=None):
+    """
+    Append the active sheet of every xlsx in `sources` ((name, bytes) pairs)
+    to the write-only `ws`, in the given order, parsing the inputs across
+    `workers` processes (1 = serial). Each file's style ids are mapped onto
+    one shared table.
+    - By position (default): header row and column widths of the first
+      file, then the data rows of all
+    - `align_headers`: columns matched by header name (see `header_keys`)
+      into the union of all headers, in order of first appearance; each
+      output column takes header style and width from the first file with it
+    - `dedupe`: drop rows already seen, by `key_column` value (rows with an
+      empty key are kept) or by a hash of the whole row; only the keys are
+      kept in memory
+    - `sort_column`: rows ordered by that column (see `sort_key`; ties keep
+      upload order) through sorted runs on disk and a k-way heap merge
+    At most `workers` parsed files wait in memory behind the one being written.
+    Returns (rows appended, duplicate rows dropped).
+    """
+    sources = list(sources)
+    shared_ids, shared_styles, arrays = {}, [None], {}
+
+    def shared(styles):
+        remap = [0]
+        for spec in styles[1:]:
+            sid = shared_ids.get(spec)
+            if sid is None:
+                sid = shared_ids[spec] = len(shared_styles)
+                shared_styles.append(spec)
+            remap.append(sid)
+        return remap
+
+    def set_widths(widths):
+        # Widths must be set before the first row is appended
+        for letter, width in widths.items():
+            ws.column_dimensions[letter].width = width
+
+    header = None
+    positions = None
+    if align_headers:
+        # Headers first (a header-only parse per file): the union layout
+        # has to be known before any data row is written.
+        columns, positions, widths = {}, [], {}
+        header_values, header_ids = [], []
+        for file_widths, (values, ids), styles in run_parallel(sheet_header, ((data,) for _name, data in sources), workers):
+            remap = shared(styles)
+            file_positions = []
+            for src, key in enumerate(header_keys(values)):
+                dst = columns.get(key)
+                if dst is None:
+                    dst = columns[key] = len(columns)
+                    header_values.append(values[src])
+                    header_ids.append(remap[ids[src]])
+                    width = file_widths.get(get_column_letter(src + 1))
+                    if width:
+                        widths[get_column_letter(dst + 1)] = width
+                file_positions.append(dst)
+            positions.append(file_positions)
+        header = (tuple(header_values), tuple(header_ids))
+    elif sort_column is not None and sources:
+        # Every input goes through `sorted_runs`, data rows only
+        widths, (values, ids), styles = sheet_header(sources[0][1])
+        remap = shared(styles)
+        header = (values, tuple(remap[sid] for sid in ids))
+    if header is not None:
+        set_widths(widths)
+        append_payload_rows(ws, [header], shared_styles, arrays)
+
+    seen = set()
+    key_col = None
+    row_count = 1 if header else 0
+    dropped = 0
+
+    def unique(rows):
+        nonlocal dropped
+        for values, ids in rows:
+            if key_col is None:
+                key = row_hash(values)
+            else:
+                key = value_key(values[key_col]) if key_col < len(values) else None
+                if key is None:
+                    yield values, ids
+                    continue
+            if key in seen:
+                dropped += 1
+                continue
+            seen.add(key)
+            yield values, ids
+
+    if sort_column is not None:
+        if not sources:
+            return 0, 0
+        sort_col = _column_index(header[0], sort_column)
+        if dedupe and key_column is not None:
+            key_col = _column_index(header[0], key_column)
+        tasks = (
+            (data, positions[i] if positions else None, sort_col)
+            for i, (_name, data) in enumerate(sources)
+        )
+        runs, run_paths = [], []
+        try:
+            for i, ((name, _data), (styles, paths)) in enumerate(zip(sources, run_parallel(sorted_runs, tasks, workers))):
+                run_paths.extend(paths)
+                remap = shared(styles)
+                runs.extend(_read_run(path, remap) for path in paths)
+                if on_progress:
+                    on_progress(i + 1, len(sources), name)
+            # heapq.merge is stable: equal keys keep the order of `runs` (upload order)
+            rows = heapq.merge(*runs, key=_row_sort_key(sort_col))
+            if dedupe:
+                rows = unique(rows)
+            row_count += append_payload_rows(ws, rows, shared_styles, arrays)
+        finally:
+            for path in run_paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return row_count, dropped
+
+    if align_headers:
+        tasks = ((data, False, file_positions) for (_name, data), file_positions in zip(sources, positions))
+    else:
+        tasks = ((data, i == 0, None) for i, (_name, data) in enumerate(sources))
+
+    # run_parallel keeps at most `workers` payloads (whole files' rows) ahead;
+    # each one is released before the next is awaited
+    results = run_parallel(merge_payload, tasks, workers)
+    for i, (name, _data) in enumerate(sources):
+        widths, rows, styles = next(results)
+        set_widths(widths)
+        remap = shared(styles)
+        rows = ((values, tuple(remap[sid] for sid in ids)) for values, ids in rows)
+        if header is None:
+            header = next(rows, ((), ()))
+            append_payload_rows(ws, [header], shared_styles, arrays)
+            row_count += 1
+        if dedupe and i == 0 and key_column is not None:
+            key_col = _column_index(header[0], key_column)
+        if dedupe:
+            rows = unique(rows)
+        row_count += append_payload_rows(ws, rows, shared_styles, arrays)
+        del rows
+        if on_progress:
+            on_progress(i + 1, len(sources), name)
+    return row_count, dropped
+
+# ------------------ Streaming table merge (CSV / mixed inputs) ------------------
+# Inputs arrive as DataFrame chunks with known column labels; the output
+# (CSV or a write-only sheet) gets the union of the labels, in order of
+# first appearance like pd.concat, and one chunk is in memory at a time.
+TABLE_CHUNK_ROWS = 50_000
+# pandas' to_excel header style, which the previous concat + to_excel output had
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"),
+                       top=Side(style="thin"), bottom=Side(style="thin"))
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+def frame_columns(headers):
+    """Labels `pd.read_excel` gives these header cells: blank -> 'Unnamed: i', repeats -> 'name.1'."""
+    labels, seen = [], set()
+    for i, header in enumerate(headers):
+        label = f"Unnamed: {i}" if header is None else header
+        base, n = label, 0
+        while label in seen:
+            n += 1
+            label = f"{base}.{n}"
+        seen.add(label)
+        labels.append(label)
+    return labels
+
+def _sheet_data_width(ws):
+    """
+    Widest row of a read-only sheet, counting up to its last cell with a
+    value (as `pd.read_excel` trims rows): one scan of the sheet XML.
+    Finished rows are dropped from the tree, so memory stays flat.
+    """
+    width, next_col = 0, 1
+    sheet_data = None
+    with ws._get_source() as src:
+        for event, el in iterparse(src, events=("start", "end")):
+            tag = el.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                if tag == "sheetData":
+                    sheet_data = el
+                continue
+            if tag == "c":
+                ref = el.get("r")
+                col = column_index_from_string(ref.rstrip("0123456789")) if ref else next_col
+                next_col = col + 1
+                if el.get("t") == "inlineStr" or any(child.tag.endswith("}v") for child in el):
+                    width = max(width, col)
+            elif tag == "row":
+                next_col = 1
+                if sheet_data is not None:
+                    sheet_data.clear()
+    return width
+
+def _first_sheet_rows(wb, columns=None):
+    """
+    (labels, row iterator after the header) of the first sheet, labels
+    padded to the widest row; pass `columns` from `sheet_columns` to skip
+    the width scan.
+    """
+    ws = wb.worksheets[0]
+    rows = ws.iter_rows(values_only=True)
+    headers = list(next(rows, ()))
+    if columns is not None:
+        return columns, rows
+    while headers and headers[-1] is None:
+        headers.pop()
+    width = len(headers)
+    # <dimension> bounds the data: scan only when it is missing or wider than the header
+    if ws.max_column is None or ws.max_column > width:
+        width = max(width, _sheet_data_width(ws))
+    return frame_columns(headers + [None] * (width - len(headers))), rows
+
+def sheet_columns(data):
+    """Column labels of the first sheet of an xlsx (bytes), as `pd.read_excel` names them."""
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        return _first_sheet_rows(wb)[0]
+    finally:
+        wb.close()
+
+def iter_sheet_chunks(data, chunksize=TABLE_CHUNK_ROWS, columns=None):
+    """
+    DataFrames of `chunksize` rows from the first sheet of an xlsx (bytes),
+    read-only. Like `pd.read_excel`, trailing empty rows are dropped and
+    columns without a header come back as 'Unnamed: i'. Pass the labels
+    `sheet_columns` returned as `columns` to save a scan of the sheet.
+    """
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        columns, rows = _first_sheet_rows(wb, columns)
+        width = len(columns)
+        batch, empty_run = [], 0
+        for row in rows:
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(v is None for v in row):
+                empty_run += 1  # written only if a non-empty row follows
+                continue
+            batch.extend([(None,) * width] * empty_run)
+            empty_run = 0
+            batch.append(row)
+            if len(batch) >= chunksize:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+    finally:
+        wb.close()
+
+def union_columns(column_lists):
+    """Ordered union of column labels (first appearance wins), as pd.concat aligns them."""
+    return list(dict.fromkeys(label for columns in column_lists for label in columns))
+
+def merge_frames(out, sources, as_csv=False, on_progress=None):
+    """
+    Stream `sources` ((name, column labels, iterable of DataFrame chunks))
+    into `out`, aligned on the union of all labels: a binary file written
+    as UTF-8 CSV with BOM when `as_csv`, else a write-only sheet.
+    Chunks are consumed one at a time. Returns the number of data rows.
+    """
+    sources = list(sources)
+    columns = union_columns(cols for _name, cols, _chunks in sources)
+    if as_csv:
+        out.write(pd.DataFrame(columns=columns).to_csv(index=False).encode("utf-8-sig"))
+    else:
+        header = []
+        for label in columns:
+            cell = WriteOnlyCell(out, value=label)
+            cell.font, cell.border, cell.alignment = HEADER_FONT, HEADER_BORDER, HEADER_ALIGNMENT
+            header.append(cell)
+        out.append(header)
+    row_count = 0
+    for i, (name, _cols, chunks) in enumerate(sources):
+        for chunk in chunks:
+            frame = chunk.reindex(columns=columns)
+            if as_csv:
+                out.write(frame.to_csv(index=False, header=False).encode("utf-8"))
+            else:
+                values = frame.astype(object).where(frame.notna(), None)
+                for row in values.itertuples(index=False, name=None):
+                    out.append(row)
+            row_count += len(frame)
+        if on_progress:
+            on_progress(i + 1, len(sources), name)
+    return row_count
+
+# ========================================================
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Local SQLite store for the online mappings (no UI code here).
+- One file shared by every session and server process
+- Rows per mapping: (key, value, name); doctor IDs are keyed by normalized name
+- Version stamp per mapping: readers reload only when it changes
+- Download validators (digest / ETag / Last-Modified) survive restarts
+- Row manifests of the Processor's incremental mode live in the same tables
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+
+from name_match import FUZZY_THRESHOLD, NameIndex
+
+BATCH_SIZE = 500  # keys per IN (...) query, below SQLite's variable limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mapping_meta (
+    source TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    digest TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    message TEXT,
+    row_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mapping_rows (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (source, key)
+) WITHOUT ROWID;
+"""
+
+
+class MappingStore:
+    """
+    SQLite file with one table of rows and one of metadata per mapping.
+    Every call opens its own connection, so it is safe from any thread.
+    Falls back to a process-local in-memory database when the file can't
+    be created (read-only disk).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._uri = False
+        self._keepalive = None
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            finally:
+                conn.close()
+        except (OSError, sqlite3.Error):
+            self.path = f"file:mappings_{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+            self._keepalive = self._connect()
+            self._keepalive.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, uri=self._uri)
+
+    def __getstate__(self):
+        # Worker processes reopen the same file
+        if self._uri:
+            raise pickle.PicklingError("an in-memory mapping store can't be shared with other processes")
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._uri = False
+        self._keepalive = None
+        self._lock = threading.Lock()
+
+    def meta(self, source):
+        """Metadata dict of the stored mapping, or None before the first import."""
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM mapping_meta WHERE source = ?", (source,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def version(self, source):
+        meta = self.meta(source)
+        return meta["version"] if meta else 0
+
+    def replace(self, source, rows, digest=None, etag=None, last_modified=None, message=""):
+        """Swap in a new set of (key, value, name) rows in one transaction; returns the new version."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM mapping_rows WHERE source = ?", (source,))
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO mapping_rows (source, key, value, name) VALUES (?, ?, ?, ?)",
+                        ((source, key, value, name) for key, value, name in rows),
+                    )
+                    count = conn.execute(
+                        "SELECT COUNT(*) FROM mapping_rows WHERE source = ?", (source,)
+                    ).fetchone()[0]
+                    version = conn.execute(
+                        "SELECT COALESCE(MAX(version), 0) + 1 FROM mapping_meta WHERE source = ?", (source,)
+                    ).fetchone()[0]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO mapping_meta VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (source, version, digest, etag, last_modified, message, count,
+                         datetime.now().timestamp()),
+                    )
+            finally:
+                conn.close()
+        return version
+
+    def touch(self, source, etag=None, last_modified=None):
+        """Record that the stored rows were confirmed current just now."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE mapping_meta SET updated_at = ?, etag = COALESCE(?, etag),"
+                    " last_modified = COALESCE(?, last_modified) WHERE source = ?",
+                    (datetime.now().timestamp(), etag, last_modified, source),
+                )
+        finally:
+            conn.close()
+
+    def lookup(self, source, keys):
+        """{key: value} for the given keys, queried in batches."""
+        keys = list(keys)
+        found = {}
+        conn = self._connect()
+        try:
+            for i in range(0, len(keys), BATCH_SIZE):
+                batch = keys[i:i + BATCH_SIZE]
+                found.update(conn.execute(
+                    f"SELECT key, value FROM mapping_rows WHERE source = ? AND key IN ({','.join('?' * len(batch))})",
+                    (source, *batch),
+                ))
+        finally:
+            conn.close()
+        return found
+
+    def rows(self, source):
+        """All (key, value, name) rows of a mapping."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT key, value, name FROM mapping_rows WHERE source = ?", (source,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+
+_PROCESS_INDEXES = {}  # (store path, source) -> (version, StoredNameIndex) unpickled in this process
+
+def _process_index(store, source, count, version):
+    """
+    Unpickle target of StoredNameIndex: one index per store file, mapping
+    and version in each process, so the keys a worker loads for its first
+    approximate search serve all of its later tasks.
+    """
+    key = (store.path, source)
+    cached = _PROCESS_INDEXES.get(key)
+    if cached is None or cached[0] != version:
+        cached = _PROCESS_INDEXES[key] = (version, StoredNameIndex(store, source, count, version))
+    return cached[1]
+
+
+class StoredNameIndex(NameIndex):
+    """
+    NameIndex over a stored mapping: exact lookups are batched queries, and
+    keys are only loaded into memory for the first approximate search.
+    """
+
+    def __init__(self, store, source, count, version=0):
+        super().__init__()
+        self.store = store
+        self.source = source
+        self.version = version
+        self._count = count
+        self._loaded = False
+
+    def __len__(self):
+        return self._count
+
+    def __reduce__(self):
+        # Only the store path travels; see _process_index
+        return _process_index, (self.store, self.source, self._count, self.version)
+
+    def get_many(self, keys):
+        return self.store.lookup(self.source, keys)
+
+    def search(self, key, threshold=FUZZY_THRESHOLD):
+        with self._lock:
+            if not self._loaded:
+                for stored_key, value, name in self.store.rows(self.source):
+                    self.add(name, value, key=stored_key)
+                self._loaded = True
+        return super().search(key, threshold)
+
+
+class RowManifest:
+    """
+    Lookup results (BUM, ID Number) of the last processed export, keyed by
+    a hash of each source row, so unchanged rows skip the lookups on the
+    next run. One manifest per `dataset` (a name the user gives a series
+    of exports) and header layout: only the latest run of each is kept.
+    Ignored when it was written under another `signature` (mapping versions
+    and match threshold). A run's rows are collected with `record` and
+    stored with `save`.
+    """
+
+    def __init__(self, store, signature, dataset=""):
+        self.store = store
+        self.signature = signature
+        self.dataset = dataset.strip().casefold()
+        self.source = None
+        self.previous = 0      # rows in the usable manifest of the last run
+        self.current = {}      # row hash -> (BUM, ID Number) of this run
+        self.unchanged = 0     # rows whose lookups were reused
+        self.changed = 0       # new or edited rows
+        self._reused = 0       # distinct manifest rows seen again
+
+    def open(self, headers):
+        """Select the manifest of this dataset and header layout; returns self."""
+        layout = hashlib.blake2b(repr((self.dataset, list(headers))).encode("utf-8"), digest_size=8).hexdigest()
+        self.source = f"manifest:{layout}"
+        meta = self.store.meta(self.source)
+        self.previous = meta["row_count"] if meta and meta["digest"] == self.signature else 0
+        return self
+
+    def lookup(self, hashes):
+        """{row hash: (BUM, ID Number)} for the hashes seen in the last run."""
+        if not self.previous:
+            return {}
+        return {key: tuple(json.loads(value)) for key, value in self.store.lookup(self.source, hashes).items()}
+
+    def record(self, row_hash, lookups, reused):
+        if reused:
+            self.unchanged += 1
+            if row_hash not in self.current:
+                self._reused += 1
+        else:
+            self.changed += 1
+        self.current[row_hash] = lookups
+
+    def save(self):
+        """Store this run's rows as the manifest for the next run."""
+        self.store.replace(
+            self.source,
+            ((key, json.dumps(lookups), "") for key, lookups in self.current.items()),
+            digest=self.signature,
+            message=f"{len(self.current)} distinct rows",
+        )
+
+    def stats(self):
+        return {
+            'unchanged': self.unchanged,
+            'changed': self.changed,
+            'removed': self.previous - self._reused,
+            'reused_manifest': bool(self.previous),
+        }
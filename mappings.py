@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Online mappings used by the Excel Processor (no UI code here).
+- Doctor name -> ID Number (normalized-name index) and MR -> BUM,
+  both from Google Sheet exports
+- Parsed once into a local SQLite store shared by all sessions and
+  server processes; sessions reload only when its version stamp changes
+- Refreshed in a background thread, with conditional downloads and a
+  content hash so unchanged sheets are not re-parsed
+- The store keeps the last good download when Google can't be reached
+"""
+
+from datetime import datetime
+from io import BytesIO
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import requests
+from openpyxl import load_workbook
+
+from mapping_store import MappingStore, StoredNameIndex
+from name_match import NameIndex, normalize_name
+
+DOCTOR_IDS_URL = "https://docs.google.com/spreadsheets/d/1-u3cegWgrsoXvJYWVwQQRJbyYbdYtjIMDIifnalwHqo/export?format=xlsx"
+BUM_MAPPING_URL = "https://docs.google.com/spreadsheets/d/1XQnQNDFHDKrWYn23ROAeFS2cELNbKurC/export?format=xlsx"
+
+MAPPING_TTL = int(os.environ.get("TFE_MAPPING_TTL", "900"))  # seconds
+FETCH_TIMEOUT = (5, 30)  # connect, read
+CACHE_DIR = os.environ.get(
+    "TFE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tricks_for_excel")
+)
+STORE = MappingStore(os.path.join(CACHE_DIR, "mappings.sqlite"))
+
+
+# ------------------ Parsers ------------------
+def parse_doctor_ids(content):
+    """Doctor ID sheet -> ([(normalized name, id, name)], message)"""
+    wb = load_workbook(BytesIO(content), read_only=True)
+    ws = wb.active
+    rows = ws.iter_rows(values_only=True)
+    first = next(rows, ())
+    headers=[str(h).strip().lower() if h else '' for h in first]
+    dcol=icol=None
+    for i,h in enumerate(headers):
+        if any(x in h for x in ['doctor','اسم','name','دكتور']): dcol=i
+        if any(x in h for x in ['id','رقم','بطاقة','national','identity']): icol=i
+    if dcol is None or icol is None: return [], f"⚠️ Missing columns: {headers}"
+    idd={}
+    for row in rows:
+        n=row[dcol] if dcol < len(row) else None; v=row[icol] if icol < len(row) else None
+        if n and v:
+            c=str(n).strip(); key=normalize_name(c)
+            if key: idd[key]=(key, str(v).strip(), c)
+    wb.close()
+    return list(idd.values()), f"✅ Loaded {len(idd)} doctor IDs"
+
+def parse_bum_mapping(content):
+    """BUM sheet -> ([(MR, BUM, MR)], message)"""
+    wb = load_workbook(filename=BytesIO(content), read_only=True)
+    ws = wb.active
+    rows = ws.iter_rows(values_only=True)
+    headers = list(next(rows, ()))
+    mr_idx = None
+    bum_idx = None
+
+    for i, header in enumerate(headers):
+        if header and "MR" in str(header):
+            mr_idx = i
+        elif header and "BUM" in str(header):
+            bum_idx = i
+
+    data = {}
+    if mr_idx is not None and bum_idx is not None:
+        for row in rows:
+            mr_value = row[mr_idx] if mr_idx < len(row) else None
+            bum_value = row[bum_idx] if bum_idx < len(row) else None
+            if mr_value and bum_value:
+                mr = str(mr_value).strip()
+                data[mr] = (mr, str(bum_value).strip(), mr)
+    wb.close()
+    if not data:
+        return [], f"⚠️ No MR/BUM columns found: {headers}"
+    return list(data.values()), f"✅ Loaded {len(data)} MR→BUM rows"
+
+
+# ------------------ Loaders (store -> in-memory value) ------------------
+def load_doctor_ids(store, source, meta):
+    """Exact lookups stay in SQLite (batched); see StoredNameIndex."""
+    return StoredNameIndex(store, source, meta["row_count"], meta["version"])
+
+def load_bum_mapping(store, source, meta):
+    """{MR: BUM} — a few hundred rows, kept in memory."""
+    return {key: value for key, value, _name in store.rows(source)}
+
+
+# ------------------ Cached source ------------------
+class MappingSource:
+    """
+    One Google Sheet export, parsed with `parse(content) -> (rows, message)`
+    into the store and read back with `load(store, name, meta) -> value`.
+    `get()` always answers from memory; a daemon thread re-checks the sheet
+    every `ttl` seconds. Failed or empty downloads keep the last good rows.
+    """
+
+    def __init__(self, name, url, parse, load, empty, ttl=MAPPING_TTL, store=STORE):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.load = load
+        self.ttl = ttl
+        self.store = store
+        self.value = empty
+        self.version = 0         # store version of `value`
+        self.message = ""
+        self.error = None
+        self.updated_at = None   # last time the rows were confirmed against Google
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def get(self, block=True):
+        """
+        (value, message). Picks up rows refreshed by any session or process;
+        the first call starts the refresher. With block=False it never waits
+        for the network.
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name=f"mapping-{self.name}", daemon=True
+                    )
+                    self._thread.start()
+        self._sync()
+        if block and self.updated_at is None:
+            self.refresh()
+        return self.value, self.status()
+
+    def status(self):
+        if self.updated_at is None:
+            if self.message or self.error:
+                return self.message or f"❌ Error: {self.error}"
+            return f"⏳ Loading {self.name.replace('_', ' ')}..."
+        msg = f"{self.message} (updated {self.updated_at:%Y-%m-%d %H:%M})"
+        if self.error:
+            msg += f" — using last good copy, refresh failed: {self.error}"
+        return msg
+
+    def _sync(self):
+        """Reload the value from the store when its version stamp moved."""
+        meta = self.store.meta(self.name)
+        if meta is None:
+            return
+        with self._lock:
+            if meta["version"] != self.version:
+                self.value = self.load(self.store, self.name, meta)
+                self.message = meta["message"]
+                self.version = meta["version"]
+            self.updated_at = datetime.fromtimestamp(meta["updated_at"])
+
+    def import_content(self, content, etag=None, last_modified=None):
+        """Parse an export (downloaded or local file) into the store. Returns True on success."""
+        digest = hashlib.sha256(content).hexdigest()
+        meta = self.store.meta(self.name)
+        if meta and meta["digest"] == digest:
+            # Same bytes as what we already parsed
+            self.store.touch(self.name, etag, last_modified)
+        else:
+            try:
+                rows, message = self.parse(content)
+            except Exception as e:
+                self.error = str(e)
+                return False
+            if not rows:
+                self.error = message
+                if self.updated_at is None:
+                    self.message = message
+                return False
+            self.store.replace(self.name, rows, digest, etag, last_modified, message)
+        self.error = None
+        self._sync()
+        return True
+
+    def refresh(self, force=False):
+        """Re-check the sheet now. Returns True when the value is current."""
+        if not self._refresh_lock.acquire(blocking=False):
+            # Another thread is already downloading: wait for its result
+            with self._refresh_lock:
+                return self.error is None
+        try:
+            meta = self.store.meta(self.name) or {}
+            headers = {}
+            if not force and meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if not force and meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            try:
+                r = requests.get(self.url, headers=headers, timeout=FETCH_TIMEOUT)
+            except requests.RequestException as e:
+                self.error = str(e)
+                return False
+            if r.status_code == 304:
+                self.store.touch(self.name)
+                self.error = None
+                self._sync()
+                return True
+            if r.status_code != 200:
+                self.error = f"HTTP {r.status_code}"
+                return False
+            return self.import_content(
+                r.content, r.headers.get("ETag"), r.headers.get("Last-Modified")
+            )
+        finally:
+            self._refresh_lock.release()
+
+    def _run(self):
+        # First check right away (the stored rows may be old), then every ttl
+        delay = 0
+        while True:
+            time.sleep(delay)
+            delay = self.ttl
+            try:
+                self.refresh()
+            except Exception as e:  # keep the refresher alive
+                self.error = str(e)
+
+
+DOCTOR_IDS = MappingSource("doctor_ids", DOCTOR_IDS_URL, parse_doctor_ids, load_doctor_ids, NameIndex())
+BUM_MAPPING = MappingSource("bum_mapping", BUM_MAPPING_URL, parse_bum_mapping, load_bum_mapping, {})
+
+
+if __name__ == "__main__":
+    # Offline import of a downloaded export:
+    #   python mappings.py doctor_ids "Doctor IDs.xlsx"
+    #   python mappings.py bum_mapping "BUM.xlsx"
+    source = {s.name: s for s in (DOCTOR_IDS, BUM_MAPPING)}[sys.argv[1]]
+    with open(sys.argv[2], "rb") as fh:
+        ok = source.import_content(fh.read())
+    print(source.status() if ok else f"❌ {source.error}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Doctor name matching (no UI code here).
+- One normalized key per name: NFKC, case, Arabic letter/diacritic folding,
+  punctuation and whitespace collapse, leading titles (Dr., د., ...) dropped
+- Trigram inverted index for the names without an exact key match,
+  scored with the Dice coefficient against a confidence threshold
+"""
+
+from collections import Counter, defaultdict
+import math
+import re
+import threading
+import unicodedata
+
+FUZZY_THRESHOLD = 0.85
+
+TITLES = {
+    "dr", "doctor", "prof", "professor",
+    "د", "دكتور", "دكتوره", "الدكتور", "الدكتوره", "ا", "استاذ", "الاستاذ",
+}
+
+# NFKD + dropping combining marks already folds hamza/madda forms (أ إ آ ؤ ئ)
+# and removes harakat; these are the letters it leaves alone.
+_ARABIC_FOLD = str.maketrans({"ى": "ي", "ة": "ه", "ی": "ي", "ک": "ك", "ـ": None})
+_PUNCT = re.compile(r"[^\w\s]|_")
+
+
+def normalize_name(name):
+    """Matching key for a person's name ('' when nothing is left)."""
+    text = unicodedata.normalize("NFKC", str(name)).casefold()
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    text = _PUNCT.sub(" ", text.translate(_ARABIC_FOLD))
+    words = text.split()
+    while len(words) > 1 and words[0] in TITLES:
+        words.pop(0)
+    return " ".join(words)
+
+def _grams(key):
+    padded = f" {key} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Normalized name -> ID, plus a trigram index over the keys for
+    approximate lookups (built on the first search). Build once, then
+    read from many sessions.
+    """
+
+    def __init__(self, pairs=()):
+        self.ids = {}          # normalized key -> ID
+        self._keys = []        # position -> key
+        self._names = []       # position -> name as written in the master list
+        self._positions = {}   # key -> position
+        self._postings = None  # trigram -> positions
+        self._lock = threading.Lock()
+        for name, value in pairs:
+            self.add(name, value)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # Sent to worker processes: the trigram index is rebuilt there on demand
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_postings"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, name, value, key=None):
+        """Add a name; pass `key` when it is already normalized."""
+        if key is None:
+            key = normalize_name(name)
+        if not key:
+            return
+        self.ids[key] = value
+        if key in self._positions:
+            return
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+        self._names.append(str(name).strip())
+        self._postings = None
+
+    def get(self, name):
+        """ID for an exact (normalized) match or None."""
+        key = normalize_name(name)
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """{key: ID} for the normalized keys that have an exact match."""
+        return {k: self.ids[k] for k in keys if k in self.ids}
+
+    def _trigram_index(self):
+        with self._lock:
+            if self._postings is None:
+                postings = defaultdict(list)
+                for pos, key in enumerate(self._keys):
+                    for gram in _grams(key):
+                        postings[gram].append(pos)
+                self._postings = postings
+            return self._postings
+
+    def search(self, key, threshold=FUZZY_THRESHOLD):
+        """
+        (ID, score, master-list name) of the closest key scoring at least
+        `threshold`, or None. Ties between different IDs count as no match.
+        """
+        index = self._trigram_index()
+        grams = _grams(key)
+        n = len(grams)
+        # Dice >= t needs at least `need` shared trigrams, so every such key
+        # sits in one of the n - need + 1 shortest posting lists.
+        need = max(1, math.ceil(threshold * n / (2 - threshold) - 1e-9))
+        postings = sorted((index.get(g, ()) for g in grams), key=len)
+        prefix_hits = Counter()
+        for positions in postings[:n - need + 1]:
+            prefix_hits.update(positions)
+
+        # A key with `hits` prefix trigrams shares at most hits + need - 1 in
+        # all, so its Dice score is at most 2c / (n + c) with that c. Verify
+        # the best-looking keys first and stop once none can beat the best.
+        best, best_score, tied = None, 0.0, False
+        for pos, hits in prefix_hits.most_common():
+            shared = min(n, hits + need - 1)
+            bound = 2 * shared / (n + shared)
+            if bound < max(best_score, threshold):
+                break
+            other = _grams(self._keys[pos])
+            score = 2 * len(grams & other) / (n + len(other))
+            if score > best_score:
+                best, best_score, tied = pos, score, False
+            elif score == best_score and best is not None and self.ids[self._keys[pos]] != self.ids[self._keys[best]]:
+                tied = True
+        if best is None or tied or best_score < threshold:
+            return None
+        return self.ids[self._keys[best]], best_score, self._names[best]
+
+    def matcher(self, threshold=FUZZY_THRESHOLD):
+        return NameMatcher(self, threshold)
+
+
+class NameMatcher:
+    """
+    Lookups for one processing run: exact key first, then the trigram search
+    (skipped at threshold 1.0). Memoized per name; fuzzy hits are kept in
+    `fuzzy` ({name: (master-list name, score)}) for review.
+    """
+
+    def __init__(self, index, threshold=FUZZY_THRESHOLD):
+        self.index = index
+        self.threshold = threshold
+        self.fuzzy = {}
+        self._memo = {}
+
+    def prefetch(self, names):
+        """Look up many names with one `get_many` call (a batched query for stored indexes)."""
+        pending = {}
+        for name in names:
+            if name not in self._memo and name not in pending:
+                pending[name] = normalize_name(name)
+        if not pending:
+            return
+        found = self.index.get_many({key for key in pending.values() if key})
+        for name, key in pending.items():
+            value = found.get(key)
+            if value is None and key and self.threshold < 1:
+                hit = self.index.search(key, self.threshold)
+                if hit is not None:
+                    value, score, master_name = hit
+                    self.fuzzy[name] = (master_name, score)
+            self._memo[name] = value
+
+    def __call__(self, name):
+        if name not in self._memo:
+            self.prefetch((name,))
+        return self._memo[name]
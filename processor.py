@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+Excel Processor engine (no UI code here).
+- Column plan: CRM Interval Date first, L1-L4 renamed, ID Number at the end
+- The plan is resolved once into row positions
+- Source read with a read-only row iterator, output streamed to a write-only sheet
+- Columnar mode: the same plan as pandas column operations, one style per column
+- Whole-workbook entry point, and a picklable batch task for worker processes
+- Incremental mode: rows whose values hash like a row of the last run reuse
+  its lookups (see `mapping_store.RowManifest`)
+"""
+
+from copy import copy
+from io import BytesIO
+import os
+from zipfile import ZipFile
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+from excel_engine import (
+    copy_cell_style, new_output_workbook, new_style_cache, read_only_column_widths, row_hash,
+)
+
+COLUMN_RENAME_MAP = {
+    "L1 Emp Name": "MR",
+    "L2 Emp Name": "DM",
+    "L3 Emp Name": "AM",
+    "L4 Emp Name": "BUM"
+}
+
+FINAL_COLUMN_ORDER = [
+    "CRM Interval Date",
+    "Tracking Number",
+    "MR",
+    "DM",
+    "AM",
+    "BUM",
+    "Line",
+    "Activity",
+    "Description",
+    "Account Number",
+    "Vendor",
+    "Bank",
+    "Cost",
+    "Bricks",
+    "Professionl Accounts",
+    "Request Professionals",
+    "Specialities",
+    "Request Date",
+]
+
+NEW_COLUMN_WIDTH = 15
+LOOKUP_BATCH = 2000  # rows whose doctor names are looked up together
+
+
+# ------------------ Column plan ------------------
+def header_positions(headers):
+    """{header: 1-based column}"""
+    return {h: i+1 for i, h in enumerate(headers) if h is not None}
+
+def find_doctor_column(headers):
+    """(1-based column with the doctor names or None, notes for the UI)"""
+    header_to_idx = header_positions(headers)
+    doctor_name_col_idx = None
+    notes = []
+    # البحث عن عمود اسم الدكتور - نبحث تحديداً عن "Professionl Accounts"
+    for col_name in headers:
+        if col_name:
+            col_name_str = str(col_name).strip()
+            # البحث عن العمود المطلوب بالضبط
+            if col_name_str == "Professionl Accounts":
+                doctor_name_col_idx = header_to_idx[col_name]
+                notes.append(f"✅ Found exact match: '{col_name}' at position {doctor_name_col_idx}")
+                break
+            # البحث عن أي عمود يحتوي على الكلمات المفتاحية
+            elif any(keyword in col_name_str.lower() for keyword in ['professionl', 'professional', 'account', 'doctor', 'name']):
+                doctor_name_col_idx = header_to_idx[col_name]
+                notes.append(f"⚠️ Found potential doctor name column: '{col_name}' at position {doctor_name_col_idx}")
+    return doctor_name_col_idx, notes
+
+def plan_columns(headers, doctor_col=None):
+    """
+    final_cols_info: one dict per output column, in output order. Types are
+    'existing', 'new', 'bum' and 'id_number'; source columns are 1-based.
+    The ID Number column is only planned when `doctor_col` is given.
+    """
+    header_to_idx = header_positions(headers)
+    mr_col_idx = None
+    bum_col_idx = None
+    crm_interval_idx = None
+
+    for old_name, new_name in COLUMN_RENAME_MAP.items():
+        if old_name in header_to_idx:
+            if new_name == "MR":
+                mr_col_idx = header_to_idx[old_name]
+            elif new_name == "BUM":
+                bum_col_idx = header_to_idx[old_name]
+
+    for col_name in headers:
+        if col_name and "CRM Interval Date" in str(col_name):
+            crm_interval_idx = header_to_idx[col_name]
+            break
+
+    final_cols_info = []
+
+    if crm_interval_idx:
+        final_cols_info.append({
+            'name': 'CRM Interval Date',
+            'type': 'existing',
+            'source_col': crm_interval_idx,
+            'original_name': headers[crm_interval_idx - 1]
+        })
+    else:
+        final_cols_info.append({
+            'name': 'CRM Interval Date',
+            'type': 'new',
+            'value': ''
+        })
+
+    for col_name in FINAL_COLUMN_ORDER[1:]:
+        if col_name == "BUM" and bum_col_idx:
+            final_cols_info.append({
+                'name': 'BUM',
+                'type': 'bum',
+                'source_col': bum_col_idx,
+                'mr_col': mr_col_idx
+            })
+        else:
+            found = False
+            for old_name, new_name in COLUMN_RENAME_MAP.items():
+                if col_name == new_name and old_name in header_to_idx:
+                    final_cols_info.append({
+                        'name': col_name,
+                        'type': 'existing',
+                        'source_col': header_to_idx[old_name],
+                        'original_name': old_name
+                    })
+                    found = True
+                    break
+
+            if not found and col_name in header_to_idx:
+                final_cols_info.append({
+                    'name': col_name,
+                    'type': 'existing',
+                    'source_col': header_to_idx[col_name],
+                    'original_name': col_name
+                })
+
+    # إضافة عمود ID Number في النهاية
+    if doctor_col:
+        final_cols_info.append({
+            'name': 'ID Number',
+            'type': 'id_number',
+            'doctor_col': doctor_col
+        })
+    return final_cols_info
+
+def compile_plan(final_cols_info):
+    """
+    (type, source position, helper position) per output column, 0-based
+    row positions (None = no such column). Resolved once per file.
+    """
+    plan = []
+    for col_info in final_cols_info:
+        kind = col_info['type']
+        if kind == 'id_number':
+            plan.append((kind, None, col_info['doctor_col'] - 1))
+        elif kind == 'bum':
+            mr_col = col_info.get('mr_col')
+            plan.append((kind, col_info['source_col'] - 1, mr_col - 1 if mr_col else None))
+        elif kind == 'existing':
+            plan.append((kind, col_info['source_col'] - 1, None))
+        else:
+            plan.append((kind, None, None))
+    return plan
+
+def plan_column_widths(final_cols_info, source_widths):
+    """Output {column letter: width}: source widths, new columns get a fixed width."""
+    widths = {}
+    for col_idx, col_info in enumerate(final_cols_info, start=1):
+        if col_info.get('source_col'):
+            width = source_widths.get(get_column_letter(col_info['source_col']))
+            if width:
+                widths[get_column_letter(col_idx)] = width
+        else:
+            widths[get_column_letter(col_idx)] = NEW_COLUMN_WIDTH
+    return widths
+
+
+# ------------------ Row processing ------------------
+def _styled(ws, src_cell, value, style_cache):
+    if not getattr(src_cell, "has_style", False):  # EmptyCell has no styles
+        return value
+    dst = WriteOnlyCell(ws, value=value)
+    copy_cell_style(src_cell, dst, style_cache)
+    return dst
+
+def write_header(out_ws, header_cells, final_cols_info, style_cache=None):
+    """Append the renamed header row, styled like the source header cells."""
+    out = []
+    for col_info in final_cols_info:
+        src = col_info.get('source_col')
+        if src and src <= len(header_cells):
+            out.append(_styled(out_ws, header_cells[src - 1], col_info['name'], style_cache))
+        else:
+            out.append(col_info['name'])
+    out_ws.append(out)
+
+def _prefetched(rows, plan, id_match, manifest=None):
+    """
+    Yield (row, row hash, reused lookups) for `rows`, looking up the doctor
+    names of each LOOKUP_BATCH rows in one go. Without a manifest the hash
+    and the reused lookups are None; with one, rows found in it skip the lookup.
+    """
+    doctor_cols = [aux for kind, _src, aux in plan if kind == 'id_number']
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == LOOKUP_BATCH:
+            yield from _prefetch_batch(batch, doctor_cols, id_match, manifest)
+            batch = []
+    yield from _prefetch_batch(batch, doctor_cols, id_match, manifest)
+
+def _prefetch_batch(batch, doctor_cols, id_match, manifest):
+    if manifest is None:
+        _prefetch_names(batch, doctor_cols, id_match)
+        return [(row, None, None) for row in batch]
+    keys = [row_hash(c.value for c in row) for row in batch]
+    previous = manifest.lookup(set(keys))
+    _prefetch_names([row for row, key in zip(batch, keys) if key not in previous], doctor_cols, id_match)
+    return [(row, key, previous.get(key)) for row, key in zip(batch, keys)]
+
+def _prefetch_names(batch, doctor_cols, id_match):
+    names = []
+    for row in batch:
+        for col in doctor_cols:
+            if col < len(row) and row[col].value:
+                names.append(str(row[col].value).strip())
+    if names:
+        id_match.prefetch(names)
+
+def process_rows(rows, plan, out_ws, bum_dict, id_match, style_cache=None, manifest=None):
+    """
+    Stream source rows (read-only cells, header excluded) into the
+    write-only `out_ws`. `id_match` maps a doctor name to its ID or None
+    (a `name_match.NameMatcher`). With a `manifest` (RowManifest), unchanged
+    rows reuse its lookups and every row is recorded in it.
+    Returns (rows, matched IDs, unmatched names).
+    """
+    row_count = 0
+    matched_count = 0
+    unmatched_doctors = {}  # insertion-ordered set
+    for row, key, reused in _prefetched(rows, plan, id_match, manifest):
+        row_count += 1
+        width = len(row)
+        bum, found_id = reused or (None, '')
+        out = []
+        for kind, src, aux in plan:
+            if kind == 'new':
+                out.append('')
+                continue
+            if kind == 'id_number':
+                doctor_name = row[aux].value if aux < width else None
+                if not doctor_name:
+                    out.append('')
+                    continue
+                if reused is None:
+                    found_id = id_match(str(doctor_name).strip()) or ''
+                if found_id:
+                    out.append(found_id)
+                    matched_count += 1
+                else:
+                    out.append('')
+                    unmatched_doctors.setdefault(str(doctor_name).strip())
+                continue
+            if src >= width:
+                out.append(None)
+                continue
+            src_cell = row[src]
+            value = src_cell.value
+            if kind == 'bum' and aux is not None and aux < width:
+                if reused is None:
+                    mr_value = row[aux].value
+                    if mr_value:
+                        bum = bum_dict.get(str(mr_value).strip())
+                if bum is not None:
+                    value = bum
+            out.append(_styled(out_ws, src_cell, value, style_cache))
+        out_ws.append(out)
+        if manifest is not None:
+            manifest.record(key, (bum, found_id), reused is not None)
+    return row_count, matched_count, list(unmatched_doctors)
+
+
+# ------------------ Columnar mode ------------------
+# Same output columns as `process_rows`, but each step is one pandas column
+# operation and every output column takes a single style (from its first
+# data cell) instead of copying styles cell by cell.
+def _name_keys(series):
+    """Stripped text for truthy values, NA elsewhere (the row path's `if value:`)."""
+    present = series.notna() & series.astype(bool)
+    return series.where(present).dropna().astype(str).str.strip().reindex(series.index)
+
+def lookup_ids(names, id_match):
+    """IDs for a Series of stripped names (NA = no name); each distinct name is matched once."""
+    distinct = names.dropna().unique()
+    id_match.prefetch(distinct)
+    found = names.map({name: id_match(name) for name in distinct})
+    return found.where(found.notna() & found.astype(bool))
+
+def sheet_frame(ws):
+    """Data rows (below the header) of a read-only sheet as an object DataFrame, columns by position."""
+    return pd.DataFrame(list(ws.iter_rows(min_row=2, values_only=True)), dtype=object)
+
+def transform_frame(df, final_cols_info, bum_dict, id_match, manifest=None):
+    """
+    Columnar `process_rows` over `sheet_frame` output (columns by position),
+    with the same optional `manifest`.
+    Returns (output frame, matched IDs, unmatched names).
+    """
+    out = {}
+    matched_count = 0
+    unmatched_doctors = []
+    bums = pd.Series(None, index=df.index, dtype=object)
+    found = pd.Series('', index=df.index, dtype=object)
+    if manifest is not None:
+        keys = pd.Series([row_hash(row) for row in df.itertuples(index=False, name=None)],
+                         index=df.index, dtype=object)
+        previous = manifest.lookup(set(keys))
+        reused = keys.isin(list(previous))
+        prev_bums = keys.map({key: bum for key, (bum, _id) in previous.items()}).astype(object)
+        prev_ids = keys.map({key: found_id for key, (_bum, found_id) in previous.items()}).astype(object)
+    for kind, src, aux in compile_plan(final_cols_info):
+        if kind == 'new':
+            col = pd.Series('', index=df.index, dtype=object)
+        elif kind == 'id_number':
+            names = _name_keys(df.iloc[:, aux]) if aux < df.shape[1] else pd.Series(index=df.index, dtype=object)
+            if manifest is not None:
+                found = lookup_ids(names.where(~reused), id_match)
+                found = prev_ids.where(reused, found)
+                found = found.where(found.notna() & found.astype(bool))
+            else:
+                found = lookup_ids(names, id_match)
+            matched_count = int(found.notna().sum())
+            unmatched_doctors = list(pd.unique(names[found.isna() & names.notna()]))
+            col = found.astype(object).where(found.notna(), '')
+        elif src >= df.shape[1]:
+            col = pd.Series(None, index=df.index, dtype=object)
+        else:
+            col = df.iloc[:, src].astype(object)
+            if kind == 'bum' and aux is not None and aux < df.shape[1]:
+                bums = _name_keys(df.iloc[:, aux]).map(bum_dict)
+                if manifest is not None:
+                    bums = prev_bums.where(reused, bums)
+                col = bums.where(bums.notna(), col)
+        out[len(out)] = col
+    frame = pd.DataFrame(out, index=df.index)
+    frame.columns = [c['name'] for c in final_cols_info]
+    if manifest is not None:
+        bums = bums.astype(object).where(bums.notna(), None)
+        found = found.astype(object).where(found.notna(), '')
+        for key, bum, found_id, was_reused in zip(keys, bums, found, reused):
+            manifest.record(key, (bum, found_id), was_reused)
+    return frame, matched_count, unmatched_doctors
+
+def column_styles(out_ws, cells, style_cache=None):
+    """One style array per output column from a sample source cell each (None = unstyled)."""
+    arrays = []
+    for cell in cells:
+        if not getattr(cell, "has_style", False):
+            arrays.append(None)
+            continue
+        dst = WriteOnlyCell(out_ws)
+        copy_cell_style(cell, dst, style_cache)
+        arrays.append(copy(dst._style))
+    return arrays
+
+def sample_cells(row, final_cols_info):
+    """The source cell each output column takes its style from (None for computed columns)."""
+    cells = []
+    for col_info in final_cols_info:
+        src = col_info.get('source_col')
+        cells.append(row[src - 1] if src and src <= len(row) else None)
+    return cells
+
+def append_frame(out_ws, frame, styles):
+    """Append `frame` rows (NaN written as empty cells) with one style per column."""
+    values = frame.astype(object).where(frame.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        out = []
+        for value, arr in zip(row, styles):
+            if arr is None:
+                out.append(value)
+                continue
+            dst = WriteOnlyCell(out_ws, value=value)
+            dst._style = copy(arr)
+            out.append(dst)
+        out_ws.append(out)
+
+
+# ------------------ Whole workbook ------------------
+def process_workbook(src, bum_dict, id_match, columnar=False, manifest=None):
+    """
+    Run the Processor on the active sheet of `src` (path or file object).
+    Returns (write-only output workbook, report); the report holds the
+    doctor-column notes, row / match counts, unmatched names and the
+    approximate matches. With a `manifest` (incremental mode) unchanged
+    rows reuse the last run's lookups, the manifest is replaced by this
+    run's rows and the report gets the diff counts.
+    """
+    # Read-only rows in, write-only rows out: memory stays flat
+    wb = load_workbook(src, read_only=True, data_only=False)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows()
+        header_cells = next(rows, ())
+        headers = [c.value for c in header_cells]
+        doctor_col, notes = find_doctor_column(headers)
+        with_ids = bool(len(id_match.index)) and doctor_col is not None
+        final_cols_info = plan_columns(headers, doctor_col if with_ids else None)
+
+        new_wb, new_ws = new_output_workbook("Processed_Data")
+        style_cache = new_style_cache()
+        for letter, width in plan_column_widths(final_cols_info, read_only_column_widths(ws)).items():
+            new_ws.column_dimensions[letter].width = width
+        write_header(new_ws, header_cells, final_cols_info, style_cache)
+        if manifest is not None:
+            manifest.open(headers + [c['name'] for c in final_cols_info])
+        if columnar:
+            styles = column_styles(new_ws, sample_cells(next(rows, ()), final_cols_info), style_cache)
+            frame, matched_count, unmatched_doctors = transform_frame(
+                sheet_frame(ws), final_cols_info, bum_dict, id_match, manifest
+            )
+            append_frame(new_ws, frame, styles)
+            row_count = len(frame)
+        else:
+            row_count, matched_count, unmatched_doctors = process_rows(
+                rows, compile_plan(final_cols_info), new_ws, bum_dict, id_match, style_cache, manifest
+            )
+    finally:
+        wb.close()
+    if manifest is not None:
+        manifest.save()
+    report = {
+        'notes': notes,
+        'doctor_col': doctor_col,
+        'with_ids': with_ids,
+        'rows': row_count,
+        'matched': matched_count,
+        'unmatched': unmatched_doctors,
+        'fuzzy': dict(id_match.fuzzy),
+        'incremental': manifest.stats() if manifest is not None else None,
+    }
+    return new_wb, report
+
+def batch_inputs(uploads):
+    """
+    (name, bytes) for every workbook in the uploads; ZIPs are expanded,
+    skipping folders, macOS metadata, Office lock files and non-Excel members.
+    """
+    for upload in uploads:
+        data = upload.getvalue()
+        if not upload.name.lower().endswith(".zip"):
+            yield upload.name, data
+            continue
+        with ZipFile(BytesIO(data)) as archive:
+            for info in archive.infolist():
+                base = os.path.basename(info.filename)
+                if (info.is_dir() or info.filename.startswith("__MACOSX/")
+                        or base.startswith(("~$", "."))
+                        or not base.lower().endswith((".xlsx", ".xlsm"))):
+                    continue
+                yield base, archive.read(info)
+
+def process_batch_file(name, data, bum_dict, id_index, threshold, columnar=False):
+    """
+    Worker task for batch mode: (name, xlsx bytes or None, report).
+    `id_index` is pickled to the worker (a StoredNameIndex only carries
+    the store path and is loaded once per worker process, see
+    `mapping_store._process_index`); failures are reported instead of raised.
+    """
+    try:
+        new_wb, report = process_workbook(BytesIO(data), bum_dict, id_index.matcher(threshold), columnar)
+        out = BytesIO()
+        new_wb.save(out)
+        return name, out.getvalue(), report
+    except Exception as e:
+        return name, None, {'error': str(e)}
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+xlsx package access without openpyxl's workbook model (no UI code here).
+- Sheet list (name, XML part, dimension) from xl/workbook.xml + its rels
+- Previews that stream only the first rows of one sheet's XML; shared
+  strings are read up to the highest index those rows use
+- Same cells -> rows conversion as `pd.read_excel`, so a preview matches
+  `pd.read_excel(..., nrows=N)` (labels, dtypes, blank rows)
+- One-sheet packages cut from a workbook at the ZIP level: the sheet XML,
+  styles, shared strings and every part it relates to are copied as
+  stored (still compressed) bytes; only workbook.xml, its rels and
+  [Content_Types].xml are rewritten
+"""
+
+from datetime import datetime
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+import pandas as pd
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+from pandas.io.parsers import TextParser
+
+from excel_engine import copy_zip_member
+
+PREVIEW_ROWS = 200
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_CELL_COLUMN = re.compile(r"[A-Z]+")
+
+
+def _tag(el):
+    return el.tag.rsplit("}", 1)[-1]
+
+def _rels(zf, part):
+    """{relationship id: package path} for a part (e.g. xl/workbook.xml)."""
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    if rels_path not in zf.NameToInfo:
+        return {}
+    rels = {}
+    with zf.open(rels_path) as src:
+        for _event, el in iterparse(src):
+            if _tag(el) == "Relationship" and el.get("TargetMode") != "External":
+                target = el.get("Target")
+                if target.startswith("/"):
+                    path = target.lstrip("/")
+                else:
+                    path = posixpath.normpath(posixpath.join(folder, target))
+                rels[el.get("Id")] = path
+    return rels
+
+def _workbook_part(zf):
+    """Path of the workbook part (xl/workbook.xml in files written by Excel)."""
+    for path in _rels(zf, "").values():
+        if path.endswith(("workbook.xml", "workbook.bin")) or "/workbook" in path:
+            return path
+    return "xl/workbook.xml"
+
+def _sheet_dimension(zf, part):
+    """The sheet's <dimension ref> (e.g. 'A1:F20001'), read from the top of its XML; None if absent."""
+    with zf.open(part) as src:
+        for _event, el in iterparse(src, events=("start",)):
+            tag = _tag(el)
+            if tag == "dimension":
+                return el.get("ref")
+            if tag == "sheetData":
+                return None
+    return None
+
+def _sheet_parts(zf, workbook):
+    """[(name, sheet XML part, relationship id)] in workbook order."""
+    rels = _rels(zf, workbook)
+    sheets = []
+    with zf.open(workbook) as src:
+        for _event, el in iterparse(src):
+            if _tag(el) == "sheet":
+                rel_id = el.get(REL_NS + "id")
+                if rels.get(rel_id) in zf.NameToInfo:
+                    sheets.append((el.get("name"), rels[rel_id], rel_id))
+    return sheets
+
+def workbook_sheets(data):
+    """
+    [(name, sheet XML part, dimension ref or None)] of an xlsx (bytes), in
+    workbook order. Only workbook.xml, its rels and the top of each sheet
+    XML are read: milliseconds even for very large workbooks.
+    """
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        return [(name, part, _sheet_dimension(zf, part))
+                for name, part, _rel_id in _sheet_parts(zf, _workbook_part(zf))]
+
+def _date_epoch(zf, workbook):
+    with zf.open(workbook) as src:
+        for _event, el in iterparse(src, events=("start",)):
+            tag = _tag(el)
+            if tag == "workbookPr":
+                return CALENDAR_MAC_1904 if el.get("date1904") in ("1", "true") else CALENDAR_WINDOWS_1900
+            if tag == "sheets":
+                break
+    return CALENDAR_WINDOWS_1900
+
+def _date_styles(zf, workbook):
+    """Indexes of the cell styles (the `s` attribute) with a date/time number format."""
+    path = _rels_of_type(zf, workbook, "styles.xml") or "xl/styles.xml"
+    if path not in zf.NameToInfo:
+        return set()
+    custom, xf_formats, in_cell_xfs = {}, [], False
+    with zf.open(path) as src:
+        for event, el in iterparse(src, events=("start", "end")):
+            tag = _tag(el)
+            if event == "start":
+                if tag == "cellXfs":
+                    in_cell_xfs = True
+                elif tag == "numFmt":
+                    custom[int(el.get("numFmtId"))] = el.get("formatCode")
+                elif tag == "xf" and in_cell_xfs:
+                    xf_formats.append(int(el.get("numFmtId", 0)))
+            elif tag == "cellXfs":
+                break
+    return {
+        i for i, fmt_id in enumerate(xf_formats)
+        if is_date_format(custom.get(fmt_id) or BUILTIN_FORMATS.get(fmt_id, ""))
+    }
+
+def _rels_of_type(zf, part, suffix):
+    return next((path for path in _rels(zf, part).values() if path.endswith(suffix)), None)
+
+def _shared_strings(zf, workbook, needed):
+    """{index: text} for the `needed` shared-string indexes; stops after the highest one."""
+    path = _rels_of_type(zf, workbook, "sharedStrings.xml") or "xl/sharedStrings.xml"
+    if not needed or path not in zf.NameToInfo:
+        return {}
+    last = max(needed)
+    strings, index, parts, phonetic = {}, 0, [], 0
+    with zf.open(path) as src:
+        for event, el in iterparse(src, events=("start", "end")):
+            tag = _tag(el)
+            if tag == "rPh":  # phonetic guide text is not part of the value
+                phonetic += 1 if event == "start" else -1
+            elif event == "end" and tag == "t" and not phonetic:
+                parts.append(el.text or "")
+            elif event == "end" and tag == "si":
+                if index in needed:
+                    strings[index] = "".join(parts)
+                parts = []
+                el.clear()
+                index += 1
+                if index > last:
+                    break
+    return strings
+
+def _number(text):
+    # pandas keeps integral numbers as int, like its openpyxl reader
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+def _inline_text(cell):
+    return "".join(t.text or "" for t in cell.iter() if _tag(t) == "t")
+
+def _sheet_cells(zf, part, max_rows, date_styles, epoch):
+    """
+    The first `max_rows` physical rows of a sheet as lists of cell values
+    (None for empty cells; shared strings as ("s", index) for later
+    lookup). Missing rows come back as empty lists.
+    """
+    rows = []
+    row, next_col = [], 1
+    with zf.open(part) as src:
+        for _event, el in iterparse(src):
+            tag = _tag(el)
+            if tag == "c":
+                ref = el.get("r")
+                col = column_index_from_string(_CELL_COLUMN.match(ref).group()) if ref else next_col
+                next_col = col + 1
+                kind = el.get("t", "n")
+                raw = next((child.text for child in el if _tag(child) == "v"), None)
+                if kind == "inlineStr":
+                    value = _inline_text(el)
+                elif raw is None:
+                    value = None
+                elif kind == "s":
+                    value = ("s", int(raw))
+                elif kind == "b":
+                    value = raw in ("1", "true")
+                elif kind == "e":
+                    value = np.nan
+                elif kind == "str":
+                    value = raw
+                elif kind == "d":
+                    value = datetime.fromisoformat(raw)
+                elif int(el.get("s", 0)) in date_styles:
+                    value = from_excel(float(raw), epoch)
+                else:
+                    value = _number(raw)
+                row.extend([None] * (col - 1 - len(row)))
+                row.append(value)
+                el.clear()
+            elif tag == "row":
+                number = int(el.get("r", len(rows) + 1))
+                while len(rows) < min(number - 1, max_rows):
+                    rows.append([])
+                if len(rows) < max_rows:
+                    rows.append(row)
+                row, next_col = [], 1
+                el.clear()
+                if len(rows) >= max_rows:
+                    break
+            elif tag == "sheetData":
+                break
+    return rows
+
+def sheet_rows(data, sheet=None, max_rows=PREVIEW_ROWS + 1):
+    """
+    The first `max_rows` rows of a sheet (name; None = first sheet) the way
+    `pd.read_excel`'s openpyxl reader builds them: "" for empty cells,
+    trailing empty cells/rows trimmed, rows padded to the widest one.
+    """
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        workbook = _workbook_part(zf)
+        sheets = {name: part for name, part, _rel_id in _sheet_parts(zf, workbook)}
+        if not sheets:
+            return []
+        if sheet is not None and sheet not in sheets:
+            raise KeyError(f"Worksheet {sheet} does not exist.")
+        part = sheets[next(iter(sheets)) if sheet is None else sheet]
+        cells = _sheet_cells(zf, part, max_rows, _date_styles(zf, workbook), _date_epoch(zf, workbook))
+        needed = {v[1] for row in cells for v in row if isinstance(v, tuple)}
+        strings = _shared_strings(zf, workbook, needed)
+    rows = []
+    last_with_data = -1
+    for i, row in enumerate(cells):
+        converted = [
+            "" if v is None else strings.get(v[1], "") if isinstance(v, tuple) else v
+            for v in row
+        ]
+        while converted and converted[-1] == "":
+            converted.pop()
+        if converted:
+            last_with_data = i
+        rows.append(converted)
+    rows = rows[:last_with_data + 1]
+    if rows:
+        width = max(len(row) for row in rows)
+        rows = [row + [""] * (width - len(row)) for row in rows]
+    return rows
+
+def sheet_preview(data, sheet=None, nrows=PREVIEW_ROWS):
+    """DataFrame of a sheet's header + first `nrows` rows, as `pd.read_excel(nrows=nrows)` returns it."""
+    rows = sheet_rows(data, sheet, nrows + 1)
+    if not rows:
+        return pd.DataFrame()
+    with TextParser(rows, header=0, skip_blank_lines=False) as parser:
+        return parser.read(nrows)
+
+
+# ------------------ One-sheet packages ------------------
+_XML_ELEMENT = r"<(?:\w+:)?{tag}\b[^>]*?(?:/>|>.*?</(?:\w+:)?{tag}>)"
+_SHEET_ELEMENT = re.compile(_XML_ELEMENT.format(tag="sheet"), re.S)
+_DEFINED_NAME = re.compile(_XML_ELEMENT.format(tag="definedName"), re.S)
+_RELATIONSHIP = re.compile(_XML_ELEMENT.format(tag="Relationship"), re.S)
+_OVERRIDE = re.compile(_XML_ELEMENT.format(tag="Override"), re.S)
+_EMPTY_DEFINED_NAMES = re.compile(r"<(?:\w+:)?definedNames\b[^>]*?(?:/>|>\s*</(?:\w+:)?definedNames>)")
+
+
+def _attr(element, name):
+    match = re.search(r"(?<![\w:])%s=\"([^\"]*)\"" % name, element)
+    return match.group(1) if match else None
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def _refers_to(formula, sheet_names):
+    """Whether a (still XML-escaped) defined-name formula points at one of `sheet_names`."""
+    for name in sheet_names:
+        quoted = _xml_escape("'" + name.replace("'", "''") + "'!")
+        if quoted in formula or re.search(r"(?<![\w.'])%s!" % re.escape(_xml_escape(name)), formula):
+            return True
+    return False
+
+def _single_sheet_workbook(xml, keep_rel_id, keep_index, other_names):
+    """workbook.xml with one <sheet> left: it is made visible and the active tab, and sheet-local names follow it."""
+    def sheet(match):
+        element = match.group()
+        if _attr(element, r"\w+:id") != keep_rel_id:
+            return ""
+        return re.sub(r'\sstate="(?:hidden|veryHidden)"', "", element)
+
+    def defined_name(match):
+        element = match.group()
+        local = _attr(element, "localSheetId")
+        if local is None:
+            return "" if _refers_to(element, other_names) else element
+        if int(local) != keep_index:
+            return ""
+        return element.replace(f'localSheetId="{local}"', 'localSheetId="0"', 1)
+
+    xml = _SHEET_ELEMENT.sub(sheet, xml)
+    xml = _EMPTY_DEFINED_NAMES.sub("", _DEFINED_NAME.sub(defined_name, xml))
+    return re.sub(r'(?<![\w:])(activeTab|firstSheet)="\d+"', r'\1="0"', xml)
+
+def _rels_path(part):
+    folder, name = posixpath.split(part)
+    return posixpath.join(folder, "_rels", name + ".rels")
+
+def _sheet_package(zf, workbook, keep, sheets):
+    """xlsx bytes holding only sheet `keep` (an item of `sheets`)."""
+    name, _part, keep_rel_id = keep
+    workbook_rels = _rels(zf, workbook)
+    # calcChain lists formula cells of every sheet; Excel rebuilds it when missing
+    dropped = {rel_id for _n, _p, rel_id in sheets if rel_id != keep_rel_id}
+    dropped |= {rel_id for rel_id, path in workbook_rels.items() if path.endswith("calcChain.xml")}
+
+    # Parts still reachable through relationships once the other sheets are gone
+    kept, todo = set(), [""]
+    while todo:
+        part = todo.pop()
+        rels = _rels(zf, part)
+        if part == workbook:
+            rels = {rel_id: path for rel_id, path in rels.items() if rel_id not in dropped}
+        for path in rels.values():
+            if path in zf.NameToInfo and path not in kept:
+                kept.add(path)
+                todo.append(path)
+    kept |= {_rels_path(part) for part in kept | {""}} & set(zf.NameToInfo)
+    kept.add("[Content_Types].xml")
+
+    def without(pattern, xml, drop):
+        return pattern.sub(lambda m: "" if drop(m.group()) else m.group(), xml)
+
+    other_names = [n for n, _p, rel_id in sheets if rel_id != keep_rel_id]
+    rewritten = {
+        workbook: _single_sheet_workbook(
+            zf.read(workbook).decode("utf-8"), keep_rel_id, sheets.index(keep), other_names
+        ),
+        _rels_path(workbook): without(
+            _RELATIONSHIP, zf.read(_rels_path(workbook)).decode("utf-8"),
+            lambda el: _attr(el, "Id") in dropped,
+        ),
+        "[Content_Types].xml": without(
+            _OVERRIDE, zf.read("[Content_Types].xml").decode("utf-8"),
+            lambda el: (_attr(el, "PartName") or "").lstrip("/") not in kept,
+        ),
+    }
+    out = BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as dst:
+        for info in zf.infolist():
+            if info.filename not in kept:
+                continue
+            if info.filename in rewritten:
+                dst.writestr(info.filename, rewritten[info.filename].encode("utf-8"))
+            else:
+                copy_zip_member(zf, info, dst)
+    return out.getvalue()
+
+def split_sheet_packages(data, on_progress=None):
+    """
+    Yield (sheet name, xlsx bytes) for every sheet of an xlsx (bytes). Each
+    output is the original package cut down to one sheet, so everything in
+    the sheet XML (conditional formatting, validations, freeze panes,
+    merged cells, widths) and its drawings/comments/tables is kept as-is.
+    """
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        workbook = _workbook_part(zf)
+        sheets = _sheet_parts(zf, workbook)
+        for i, sheet in enumerate(sheets):
+            yield sheet[0], _sheet_package(zf, workbook, sheet, sheets)
+            if on_progress:
+                on_progress(i + 1, len(sheets), sheet[0])